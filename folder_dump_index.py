@@ -0,0 +1,138 @@
+import os
+import sys
+import mmap
+import gzip
+import lzma
+import json
+import difflib
+import hashlib
+import argparse
+from typing import BinaryIO, Dict, List, Optional
+from dataclasses import dataclass
+
+from folder_serializer import FolderSerializer
+from folder_serializer_output import OutputSink
+
+
+class DumpIndexError(Exception):
+    """The manifest does not describe the requested file, or the dump no longer matches the manifest"""
+
+
+@dataclass
+class DumpIndex:
+    """Random access to the file blocks of an existing dump through its '<output>.manifest.json'.
+
+    Uncompressed parts are memory mapped and sliced, compressed parts are decompressed up to the
+    block. Either way only one part is touched and the dump is never scanned for markers.
+    """
+    manifest_path: str
+    root: str
+    compression: Optional[str]
+    chunks: List[Dict[str, object]]
+    files: Dict[str, Dict[str, object]]
+
+    @classmethod
+    def load(cls, manifest_path: str) -> 'DumpIndex':
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return cls(
+            manifest_path=manifest_path,
+            root=manifest.get("root", ""),
+            compression=manifest.get("compression"),
+            chunks=manifest["chunks"],
+            files={file_record["path"]: file_record for file_record in manifest["files"]},
+        )
+
+    @staticmethod
+    def main() -> None:
+        parser = argparse.ArgumentParser(description="Read single files from a serialized folder through its manifest")
+        subparsers = parser.add_subparsers(dest="command", required=True)
+
+        list_parser = subparsers.add_parser("list", help="List the files in a dump")
+        list_parser.add_argument("manifest")
+
+        extract_parser = subparsers.add_parser("extract", help="Print the content of one file as it is in the dump")
+        extract_parser.add_argument("manifest")
+        extract_parser.add_argument("path", help="Path relative to the serialized folder, as in the dump")
+
+        diff_parser = subparsers.add_parser("diff", help="Diff one file in the dump against the file on disk or another dump")
+        diff_parser.add_argument("manifest")
+        diff_parser.add_argument("path", help="Path relative to the serialized folder, as in the dump")
+        diff_parser.add_argument("--against", help="Manifest of another dump to compare with, instead of the file on disk")
+
+        args = parser.parse_args()
+        index = DumpIndex.load(args.manifest)
+        try:
+            if args.command == "list":
+                for relative_path, file_record in index.files.items():
+                    print(f"{file_record['size']:>12} {relative_path}")
+            elif args.command == "extract":
+                sys.stdout.buffer.write(index.read_bytes(args.path))
+            else:
+                other = DumpIndex.load(args.against) if args.against else None
+                sys.stdout.write(index.diff(args.path, other))
+        except DumpIndexError as e:
+            print(str(e), file=sys.stderr)
+            sys.exit(1)
+
+    def read_bytes(self, relative_path: str, verify: bool = True) -> bytes:
+        """The UTF-8 content of one file block, checked against the hash recorded when it was written"""
+        file_record = self._file_record(relative_path)
+        chunk_path = os.path.join(os.path.dirname(self.manifest_path), self.chunks[file_record["chunk"]]["path"])
+        offset, length = file_record["content_offset"], file_record["content_bytes"]
+        if self.compression is None:
+            with open(chunk_path, 'rb') as f:
+                if length == 0:
+                    content = b""
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        content = mapped[offset:offset + length]
+        else:
+            with self._open_compressed(chunk_path) as f:
+                f.seek(offset)
+                content = f.read(length)
+        if verify and file_record.get("sha256") and hashlib.sha256(content).hexdigest() != file_record["sha256"]:
+            raise DumpIndexError(f"Content of {relative_path} in {chunk_path} does not match the manifest")
+        return content
+
+    def extract(self, relative_path: str) -> str:
+        return FolderSerializer._decode_text(self.read_bytes(relative_path))
+
+    def diff(self, relative_path: str, other: Optional['DumpIndex'] = None) -> str:
+        """Unified diff from this dump's content to 'other's, or to the file as it is on disk now"""
+        old_lines = self.extract(relative_path).splitlines(keepends=True)
+        if other is not None:
+            new_lines = other.extract(relative_path).splitlines(keepends=True)
+            new_label = f"{other.manifest_path}:{relative_path}"
+        else:
+            file_path = os.path.join(self.root, relative_path)
+            try:
+                with open(file_path, 'rb') as f:
+                    new_lines = FolderSerializer._decode_text(f.read()).splitlines(keepends=True)
+            except FileNotFoundError:
+                new_lines = []
+            new_label = file_path
+        return "".join(difflib.unified_diff(old_lines, new_lines, f"{self.manifest_path}:{relative_path}", new_label))
+
+    def _file_record(self, relative_path: str) -> Dict[str, object]:
+        file_record = self.files.get(relative_path)
+        if file_record is None:
+            # Accept '/' on every platform, since that is how paths are usually typed
+            file_record = self.files.get(relative_path.replace("/", os.sep))
+        if file_record is None:
+            raise DumpIndexError(f"{relative_path} is not in {self.manifest_path}")
+        return file_record
+
+    def _open_compressed(self, chunk_path: str) -> BinaryIO:
+        if self.compression == "gzip":
+            return gzip.open(chunk_path, 'rb')
+        if self.compression == "xz":
+            return lzma.open(chunk_path, 'rb')
+        zstd = OutputSink._zstd_module()
+        if zstd is None:
+            raise DumpIndexError("Reading zstd dumps needs Python 3.14 or the 'zstandard' package")
+        return zstd.open(chunk_path, 'rb')
+
+
+if __name__ == "__main__":
+    DumpIndex.main()
@@ -1,7 +1,306 @@
 import os
+import sys
+import re
 import json
-from typing import Dict, Set, ClassVar, List
-from dataclasses import dataclass
+import codecs
+import time
+import functools
+import io
+import contextlib
+from collections import deque
+from typing import Dict, Set, ClassVar, List, Iterator, TextIO, BinaryIO, Optional, Tuple, Iterable, Pattern, Union, Callable, TYPE_CHECKING
+from dataclasses import dataclass, field, replace
+
+if TYPE_CHECKING:
+    import mmap
+    import threading
+    from folder_serializer_async import AsyncPipeline
+    from folder_serializer_batch import SharedScan
+    from folder_serializer_cache import ContentCache
+    from folder_serializer_output import OutputSink
+    from folder_serializer_profile import FileReport, RunProfile
+    from folder_serializer_transforms import LineTransform
+
+@dataclass
+class FolderEntry:
+    """A file or folder found by the single scandir pass, together with its filter decision"""
+    name: str
+    relative_path: str
+    is_dir: bool
+    size: int = 0
+    mtime_ns: int = 0
+    is_included: bool = True
+    is_binary: bool = False
+    is_over_budget: bool = False
+    # Set in snapshot diff mode: "added", "modified" or "removed"
+    change: Optional[str] = None
+    # Set by the dedup stage: relative path of the first file with the same content
+    duplicate_of: Optional[str] = None
+    folders: List['FolderEntry'] = field(default_factory=list)
+    files: List['FolderEntry'] = field(default_factory=list)
+
+@dataclass
+class RawFileBlock:
+    """A file block whose content is copied byte for byte from a file already checked to be valid UTF-8"""
+    file: BinaryIO
+    size: int
+    length: int
+    prefix: str = ""
+    suffix: str = ""
+
+    def __len__(self) -> int:
+        return len(self.prefix) + self.length + len(self.suffix)
+
+@dataclass
+class FilterMatcher:
+    """A list of names, paths and glob patterns compiled into one set lookup plus two combined regexes.
+
+    Patterns follow .gitignore syntax: plain names match a basename at any depth, patterns containing
+    a '/' are anchored to the root folder, '*', '?', '[...]' and '**' are globs, a trailing '/' only
+    matches folders and a leading '!' negates the pattern (later patterns win).
+    """
+    names: Set[str] = field(default_factory=set)
+    name_regex: Optional[Pattern] = None
+    path_regex: Optional[Pattern] = None
+    # Negated or folder-only rules cannot be folded into the combined regexes and are evaluated in order
+    ordered_rules: List[Tuple[Pattern, bool, bool, bool]] = field(default_factory=list)
+
+    _GLOB_CHARACTERS: ClassVar[str] = "*?["
+
+    @classmethod
+    def compile(cls, patterns: Iterable[str], keep_order: bool = False) -> 'FilterMatcher':
+        """Compile 'patterns'. With 'keep_order', every pattern is evaluated in order, as in a .gitignore file."""
+        patterns = [pattern for pattern in patterns if pattern is not None]
+        if keep_order:
+            return cls(ordered_rules=[cls._compile_pattern(pattern) for pattern in patterns])
+
+        names = set()
+        name_regexes = []
+        path_regexes = []
+        rules = [cls._compile_pattern(pattern) for pattern in patterns if cls._needs_regex(pattern)]
+
+        # Order only matters once a negation or folder-only rule is present
+        if any(negated or folder_only for _, negated, folder_only, _ in rules):
+            return cls(names={pattern for pattern in patterns if not cls._needs_regex(pattern)}, ordered_rules=rules)
+
+        for pattern in patterns:
+            if not cls._needs_regex(pattern):
+                names.add(pattern)
+        for regex, _, _, is_anchored in rules:
+            (path_regexes if is_anchored else name_regexes).append(regex.pattern)
+        return cls(
+            names=names,
+            name_regex=re.compile("|".join(f"(?:{regex})" for regex in name_regexes)) if name_regexes else None,
+            path_regex=re.compile("|".join(f"(?:{regex})" for regex in path_regexes)) if path_regexes else None,
+        )
+
+    def is_empty(self) -> bool:
+        return not self.names and self.name_regex is None and self.path_regex is None and not self.ordered_rules
+
+    def has_path_rules(self) -> bool:
+        return self.path_regex is not None or any(is_anchored for _, _, _, is_anchored in self.ordered_rules)
+
+    def matches_name(self, name: str, is_dir: bool = False) -> bool:
+        """Match rules that only look at the basename; these decisions can be memoized per name"""
+        if self.ordered_rules:
+            return self._matches_ordered(name, name, is_dir, anchored=False)
+        return name in self.names or (self.name_regex is not None and self.name_regex.match(name) is not None)
+
+    def matches_path(self, relative_path: str, is_dir: bool = False) -> bool:
+        """Match rules anchored to the root. 'relative_path' must use '/' as separator."""
+        if self.ordered_rules:
+            return self._matches_ordered(relative_path, relative_path, is_dir, anchored=True)
+        return self.path_regex is not None and self.path_regex.match(relative_path) is not None
+
+    def matches(self, name: str, relative_path: Optional[str], is_dir: bool = False) -> bool:
+        if self.ordered_rules:
+            path = relative_path if relative_path is not None else name
+            return self._matches_ordered(name, path, is_dir, anchored=None)
+        if self.matches_name(name, is_dir):
+            return True
+        return relative_path is not None and self.matches_path(relative_path, is_dir)
+
+    def match_state(self, name: str, relative_path: str, is_dir: bool = False) -> Optional[bool]:
+        """Like matches(), but None when no rule applies, so several .gitignore files can be layered"""
+        state = True if name in self.names else None
+        for regex, negated, folder_only, is_anchored in self.ordered_rules:
+            if folder_only and not is_dir:
+                continue
+            if regex.match(relative_path if is_anchored else name):
+                state = not negated
+        return state
+
+    def _matches_ordered(self, name: str, relative_path: str, is_dir: bool, anchored: Optional[bool]) -> bool:
+        is_match = name in self.names and anchored is not True
+        for regex, negated, folder_only, is_anchored in self.ordered_rules:
+            if anchored is not None and is_anchored != anchored:
+                continue
+            if folder_only and not is_dir:
+                continue
+            if regex.match(relative_path if is_anchored else name):
+                is_match = not negated
+        return is_match
+
+    @classmethod
+    def read_ignore_file(cls, ignore_file_path: str) -> List[str]:
+        """Read the patterns of a .gitignore-style file, skipping blank lines and comments"""
+        with open(ignore_file_path, 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+        patterns = []
+        for line in lines:
+            # Trailing spaces are ignored unless escaped with a backslash
+            if line.endswith("\\ "):
+                line = line.rstrip(" ") + " "
+            else:
+                line = line.rstrip(" ")
+            if line and not line.startswith("#"):
+                patterns.append(line)
+        return patterns
+
+    @classmethod
+    def _needs_regex(cls, pattern: str) -> bool:
+        return "/" in pattern or pattern.startswith("!") or any(character in pattern for character in cls._GLOB_CHARACTERS)
+
+    @classmethod
+    def _compile_pattern(cls, pattern: str) -> Tuple[Pattern, bool, bool, bool]:
+        """Translate one .gitignore-style pattern into (regex, negated, folder_only, is_anchored)"""
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        elif pattern.startswith("\\"):
+            # An escaped leading '!' or '#' is literal
+            pattern = pattern[1:]
+        folder_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        is_anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+
+        regex = ""
+        index = 0
+        while index < len(pattern):
+            character = pattern[index]
+            if pattern.startswith("**/", index):
+                regex += "(?:.*/)?"
+                index += 3
+                continue
+            if pattern.startswith("**", index):
+                regex += ".*"
+                index += 2
+                continue
+            if character == "*":
+                regex += "[^/]*"
+            elif character == "?":
+                regex += "[^/]"
+            elif character == "[":
+                end = pattern.find("]", index + 1)
+                if end == -1:
+                    regex += re.escape(character)
+                else:
+                    character_class = pattern[index + 1:end]
+                    if character_class.startswith("!"):
+                        character_class = "^" + character_class[1:]
+                    regex += f"[{character_class}]"
+                    index = end
+            elif character == "\\" and index + 1 < len(pattern):
+                index += 1
+                regex += re.escape(pattern[index])
+            else:
+                regex += re.escape(character)
+            index += 1
+        return re.compile(regex + "$"), negated, folder_only, is_anchored
+
+@dataclass
+class FolderFilters:
+    """The global lists plus a config's blacklist/whitelist, compiled once and memoized per name"""
+    folder_blacklist: FilterMatcher
+    folder_whitelist: FilterMatcher
+    file_blacklist: FilterMatcher
+    file_whitelist: FilterMatcher
+    binary_extensions: Set[str]
+    extension_whitelist: Set[str]
+    extension_blacklist: Set[str]
+
+    _folder_decisions: Dict[str, Tuple[bool, bool]] = field(default_factory=dict)
+    _file_decisions: Dict[str, Tuple[bool, bool, bool, bool]] = field(default_factory=dict)
+
+    def should_process_folder(self, folder_name: str, relative_path: Optional[str] = None) -> bool:
+        decision = self._folder_decisions.get(folder_name)
+        if decision is None:
+            decision = (self.folder_blacklist.matches_name(folder_name, is_dir=True), self.folder_whitelist.matches_name(folder_name, is_dir=True))
+            self._folder_decisions[folder_name] = decision
+        is_blacklisted, is_whitelisted = decision
+
+        if relative_path and self._has_folder_path_rules:
+            path = relative_path.replace(os.sep, "/")
+            is_blacklisted = self._match_with_path(self.folder_blacklist, is_blacklisted, folder_name, path, is_dir=True)
+            is_whitelisted = self._match_with_path(self.folder_whitelist, is_whitelisted, folder_name, path, is_dir=True)
+
+        if is_blacklisted:
+            return False
+        return is_whitelisted or self.folder_whitelist.is_empty()
+
+    def file_decision(self, file_name: str, relative_path: Optional[str] = None) -> Tuple[bool, bool]:
+        """Return (should_process, has_binary_extension) for a file"""
+        decision = self._file_decisions.get(file_name)
+        if decision is None:
+            decision = self._decide_file_name(file_name)
+            self._file_decisions[file_name] = decision
+        is_binary, extension_allowed, is_blacklisted, is_whitelisted = decision
+        if not (relative_path and self._has_file_path_rules):
+            return extension_allowed and not is_blacklisted and is_whitelisted, is_binary
+
+        path = relative_path.replace(os.sep, "/")
+        is_blacklisted = self._match_with_path(self.file_blacklist, is_blacklisted, file_name, path, is_dir=False)
+        is_whitelisted = self._match_with_path(self.file_whitelist, is_whitelisted, file_name, path, is_dir=False) or self.file_whitelist.is_empty()
+        return extension_allowed and not is_blacklisted and is_whitelisted, is_binary
+
+    def _decide_file_name(self, file_name: str) -> Tuple[bool, bool, bool, bool]:
+        """Everything about a file's decision that depends only on its name"""
+        file_name_without_extension, file_extension = os.path.splitext(file_name)
+        file_extension = file_extension.lower()
+        is_binary = file_extension in self.binary_extensions
+
+        # Binary extensions are never processed; then the user-defined extension rules apply
+        extension_allowed = (
+            not is_binary
+            and (not self.extension_whitelist or file_extension in self.extension_whitelist)
+            and file_extension not in self.extension_blacklist
+        )
+
+        # Check specific file (e.g. hello_world.py) and without extension (e.g. hello_world)
+        is_blacklisted = self.file_blacklist.matches_name(file_name) or self.file_blacklist.matches_name(file_name_without_extension)
+        is_whitelisted = (
+            self.file_whitelist.is_empty()
+            or self.file_whitelist.matches_name(file_name)
+            or self.file_whitelist.matches_name(file_name_without_extension)
+        )
+        return is_binary, extension_allowed, is_blacklisted, is_whitelisted
+
+    @staticmethod
+    def _match_with_path(matcher: FilterMatcher, name_result: bool, name: str, path: str, is_dir: bool) -> bool:
+        """Combine a memoized name decision with the rules anchored to the root"""
+        if matcher.ordered_rules:
+            # With negations the last matching rule wins, so name and path rules are evaluated together
+            return matcher.matches(name, path, is_dir) or (name_result and not matcher.matches_name(name, is_dir))
+        return name_result or matcher.matches_path(path, is_dir)
+
+    def __post_init__(self) -> None:
+        self._has_folder_path_rules = self.folder_blacklist.has_path_rules() or self.folder_whitelist.has_path_rules()
+        self._has_file_path_rules = self.file_blacklist.has_path_rules() or self.file_whitelist.has_path_rules()
+
+@dataclass
+class LocalFileSystem:
+    """The file system operations of a scan and its reads. Subclasses may add latency or route them elsewhere."""
+
+    def scandir(self, folder_path: str) -> Dict[str, os.DirEntry]:
+        with os.scandir(folder_path) as it:
+            return {dir_entry.name: dir_entry for dir_entry in it}
+
+    def stat(self, dir_entry: os.DirEntry) -> os.stat_result:
+        return dir_entry.stat()
+
+    def open(self, file_path: str, mode: str = 'r', **kwargs):
+        return open(file_path, mode, **kwargs)
 
 @dataclass
 class FolderSerializer:
@@ -142,8 +441,86 @@ class FolderSerializer:
     }
 
     @staticmethod
-    def main(config_name: str) -> None:
-        """Serialize folder in 'config_name'.json and write output to 'config_name'.txt"""
+    def main(config_name: str, workers: Optional[int] = None, profile: bool = False, since: Optional[str] = None,
+             output_path: Optional[str] = None) -> None:
+        """Serialize folder in 'config_name'.json and write output to 'config_name'.txt, or to 'output_path' ('-' for stdout).
+
+        With 'since' (the manifest of an earlier run), only the changes are written, to 'config_name'.diff.txt.
+        """
+        serializer, config_output_path = FolderSerializer._load_config_by_name(config_name)
+        FolderSerializer._configure_run(serializer, config_output_path, config_name, workers, profile)
+        if since is not None:
+            serializer.enable_snapshot_diff(since)
+            config_output_path = os.path.splitext(config_output_path)[0] + FolderSerializer._DIFF_OUTPUT_SUFFIX
+
+        output_path = output_path or config_output_path
+        serializer.stream_output(output_path)
+        serializer.print_summary()
+
+    @staticmethod
+    def main_roots(roots: List[str], config_name: Optional[str] = None, filters: Optional[Dict[str, Dict[str, List[str]]]] = None,
+                   output_path: Optional[str] = None, workers: Optional[int] = None, profile: bool = False) -> None:
+        """Serialize each folder in 'roots', one after another, to 'output_path' (stdout by default).
+
+        Settings come from 'config_name'.json if given, otherwise every non-binary file outside the global
+        blacklist is included. 'filters' ({"blacklist": {"extensions": [...], ...}, "whitelist": ...}) extend either.
+        """
+        output_path = output_path or FolderSerializer._STDOUT_PATH
+        if len(roots) > 1 and output_path != FolderSerializer._STDOUT_PATH:
+            raise ValueError("Several roots can only be written to stdout")
+        for root in roots:
+            if config_name is not None:
+                serializer, config_output_path = FolderSerializer._load_config_by_name(config_name)
+            else:
+                serializer = FolderSerializer.create_from_dict({FolderSerializer._FOLDER_TO_SERIALIZE: root})
+                config_output_path = output_path
+            serializer.folder_to_serialize = os.path.abspath(root)
+            if filters:
+                serializer.add_filters(filters)
+            FolderSerializer._configure_run(serializer, config_output_path, config_name or os.path.basename(serializer.folder_to_serialize), workers, profile)
+            serializer.stream_output(output_path)
+            serializer.print_summary()
+
+    @staticmethod
+    def main_batch(config_patterns: List[str], workers: Optional[int] = None, jobs: Optional[int] = None, profile: bool = False) -> None:
+        """Serialize every config matching 'config_patterns' (names or globs, without '.json') in one process pool.
+
+        Configs over the same root run in the same worker process and share one SharedScan, so each
+        folder is listed once per root and each file is read once while its content fits the scan's cap.
+        Different roots run in parallel; nested roots (e.g. 'repo' and 'repo/src') count as different roots.
+        """
+        config_names = FolderSerializer._expand_config_names(config_patterns)
+        if not config_names:
+            print(f"No configs match {', '.join(config_patterns)}")
+            return
+        groups = FolderSerializer._group_configs_by_root(config_names)
+        run_group = functools.partial(FolderSerializer._run_batch_group, workers=workers, profile=profile)
+
+        jobs = min(jobs or os.cpu_count() or 1, len(groups))
+        if jobs <= 1:
+            group_results = [run_group(group) for group in groups]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                group_results = list(executor.map(run_group, groups))
+        FolderSerializer._print_batch_summary([result for results in group_results for result in results])
+
+    @staticmethod
+    def watch(config_name: str, workers: Optional[int] = None, use_polling: bool = False) -> None:
+        """Serialize folder in 'config_name'.json, then keep 'config_name'.txt up to date until interrupted"""
+        from folder_watcher import FolderWatcher
+        serializer, output_path = FolderSerializer._load_config_by_name(config_name)
+        if workers is not None:
+            serializer._workers = workers
+        FolderWatcher(serializer, output_path, use_polling=use_polling).run()
+
+    ###########################
+    ### PRIVATE CLASS STUFF ###
+    ###########################
+
+    @staticmethod
+    def _load_config_by_name(config_name: str) -> Tuple['FolderSerializer', str]:
+        """Create serializer from 'config_name'.json and return it together with its output path"""
         FALLBACK_FOLDER = FolderSerializer._FALLBACK_FOLDER
         INPUT_FOLDER = FolderSerializer._INPUT_FOLDER
         OUTPUT_FOLDER = FolderSerializer._OUTPUT_FOLDER
@@ -157,19 +534,123 @@ class FolderSerializer:
             fallback_config_path = os.path.join(FALLBACK_FOLDER, INPUT_FOLDER, f"{config_name}.json")
             serializer = FolderSerializer.create_from_config(fallback_config_path)
             output_path = os.path.join(FALLBACK_FOLDER, OUTPUT_FOLDER, f"{config_name}.txt")
+        return serializer, output_path
 
-        serializer.serialize_folder()
-        serializer.print_summary()
-        serializer.write_output(output_path)
+    @staticmethod
+    def _configure_run(serializer: 'FolderSerializer', output_path: str, config_name: str, workers: Optional[int], profile: bool) -> None:
+        """Apply command line overrides and the optional features enabled in the config"""
+        if workers is not None:
+            serializer._workers = workers
+        if serializer._cache_config.get("enabled", False):
+            serializer.enable_cache(FolderSerializer._cache_folder_for(output_path, config_name, serializer.folder_to_serialize))
+        if profile or serializer._profiling.get("enabled", False):
+            serializer.enable_profiling()
 
-    ###########################
-    ### PRIVATE CLASS STUFF ###
-    ###########################
+    @staticmethod
+    def _expand_config_names(config_patterns: List[str]) -> List[str]:
+        """Config names matching the patterns in 'program_inputs', or in the fallback folder when nothing matches there"""
+        import glob
+        config_names = []
+        for pattern in config_patterns:
+            for input_folder in (FolderSerializer._INPUT_FOLDER, os.path.join(FolderSerializer._FALLBACK_FOLDER, FolderSerializer._INPUT_FOLDER)):
+                matches = sorted(glob.glob(os.path.join(input_folder, f"{pattern}.json")))
+                if matches:
+                    break
+            for config_path in matches:
+                config_name = os.path.splitext(os.path.basename(config_path))[0]
+                if config_name not in config_names:
+                    config_names.append(config_name)
+        return config_names
+
+    @staticmethod
+    def _group_configs_by_root(config_names: List[str]) -> List[List[str]]:
+        """Group config names by the real path of their 'folder_to_serialize', keeping the given order.
+
+        Only identical roots are grouped: shared keys are relative to the root, so nested roots share nothing.
+        """
+        groups: Dict[str, List[str]] = {}
+        for config_name in config_names:
+            serializer, _ = FolderSerializer._load_config_by_name(config_name)
+            groups.setdefault(os.path.realpath(serializer.folder_to_serialize), []).append(config_name)
+        return list(groups.values())
+
+    @staticmethod
+    def _run_batch_group(config_names: List[str], workers: Optional[int] = None, profile: bool = False) -> List[Dict[str, object]]:
+        """Serialize configs that share a root one after another. Their messages are returned instead of printed."""
+        from folder_serializer_batch import SharedScan
+        shared_scan = SharedScan()
+        runs = []
+        for config_name in config_names:
+            log = io.StringIO()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(log):
+                serializer, output_path = FolderSerializer._load_config_by_name(config_name)
+                FolderSerializer._configure_run(serializer, output_path, config_name, workers, profile)
+                serializer.use_shared_scan(shared_scan)
+                # Every config announces its reads before the first one reads, so each content is dropped after its last reader
+                serializer._expect_shared_reads()
+            runs.append((config_name, serializer, output_path, log, time.perf_counter() - started))
+
+        results = []
+        for config_name, serializer, output_path, log, prepare_seconds in runs:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(log):
+                output_length = serializer.stream_output(output_path)
+            shared_scan.release_reads(serializer._shared_reads)
+            results.append({
+                "config": config_name,
+                "root": serializer.folder_to_serialize,
+                "output_path": output_path,
+                "output_length": output_length,
+                "seconds": prepare_seconds + time.perf_counter() - started,
+                "files_read": serializer._traversed_files,
+                "binaries": serializer._binary_files,
+                "skipped": serializer._skipped_files,
+                "over_budget": serializer._over_budget_files,
+                "errors": serializer._read_errors,
+                "listings_reused": shared_scan.listings_reused,
+                "contents_reused": shared_scan.contents_reused,
+                "log": log.getvalue(),
+            })
+        return results
+
+    @staticmethod
+    def _print_batch_summary(results: List[Dict[str, object]]) -> None:
+        for result in results:
+            print(f"[{result['config']}]")
+            print(result["log"], end="")
+
+        print(f"{'Config':<24} {'Files':>7} {'Binaries':>9} {'Skipped':>8} {'Errors':>7} {'Characters':>12} {'Seconds':>8}")
+        for result in results:
+            print(f"{result['config']:<24} {result['files_read']:>7} {result['binaries']:>9} {result['skipped']:>8} "
+                  f"{result['errors']:>7} {result['output_length']:>12} {result['seconds']:>8.2f}")
+        totals = {key: sum(result[key] for result in results) for key in ("files_read", "binaries", "skipped", "errors", "output_length")}
+        print(f"{'Total (' + str(len(results)) + ' configs)':<24} {totals['files_read']:>7} {totals['binaries']:>9} {totals['skipped']:>8} "
+              f"{totals['errors']:>7} {totals['output_length']:>12}")
+
+        # The counters are cumulative per root, so the last config of each root holds its final values
+        last_per_root = {result["root"]: result for result in results}
+        print(f"Shared folder listings: {sum(result['listings_reused'] for result in last_per_root.values())}")
+        print(f"Shared file reads: {sum(result['contents_reused'] for result in last_per_root.values())}")
+
+    @staticmethod
+    def _cache_folder_for(output_path: str, config_name: str, root: str) -> str:
+        """The cache lives in 'program_cache/<config_name>/<root>' next to the 'program_outputs' folder.
+
+        Cache keys are relative paths, so each root gets a folder of its own; roots served by one config
+        (e.g. main_roots) then do not evict each other.
+        """
+        import hashlib
+        outputs_parent = os.path.dirname(os.path.dirname(output_path))
+        root_key = hashlib.sha1(os.path.realpath(root).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(outputs_parent, FolderSerializer._CACHE_FOLDER, config_name, root_key)
 
     # Hardcoded values for input/output folders
     _INPUT_FOLDER = "program_inputs"
     _OUTPUT_FOLDER = "program_outputs"
     _FALLBACK_FOLDER = "folder_to_text"
+    _CACHE_FOLDER = "program_cache"
+    _STDOUT_PATH = "-"
 
     # Keys used in config.json
     _FOLDER_TO_SERIALIZE = 'folder_to_serialize'
@@ -181,6 +662,62 @@ class FolderSerializer:
     _SHOW_FIRST = 'show_first'
     _SHOW_LAST = 'show_last'
     _LLM_SEPARATOR = 'llm_separator'
+    _WORKERS = 'workers'
+    _CACHE = 'cache'
+    _BINARY_SNIFFING = 'binary_sniffing'
+    _LIMITS = 'limits'
+    _GITIGNORE = 'gitignore'
+    _MMAP_THRESHOLD_BYTES = 'mmap_threshold_bytes'
+    _PROFILING = 'profiling'
+    _HIERARCHY = 'hierarchy'
+    _ASYNC_IO = 'async_io'
+    _DEDUP = 'dedup'
+    _TRANSFORMS = 'transforms'
+    # Transforms under this key apply to every extension, before the extension's own
+    _ALL_EXTENSIONS = '*'
+    _OUTPUT = 'output'
+
+    # The manifest of an output is written next to it, as '<output>.manifest.json'
+    _MANIFEST_SUFFIX = ".manifest.json"
+    # Snapshot diffs go next to the full output, so its manifest stays usable
+    _DIFF_OUTPUT_SUFFIX = ".diff.txt"
+
+    # The profiling report is written next to the output, as '<output>.profile.json'
+    _PROFILE_REPORT_SUFFIX = ".profile.json"
+
+    # Files at least this large are copied without decoding when they are valid UTF-8
+    _DEFAULT_MMAP_THRESHOLD_BYTES = 1024 * 1024
+    _UTF8_CHECK_CHUNK_BYTES = 1024 * 1024
+    _HASH_CHUNK_BYTES = 1024 * 1024
+
+    # Content of the block written for a file that is gone since the snapshot
+    _REMOVED_FILE_TEXT = "[Removed file - NO LONGER IN THE FOLDER]"
+
+    # Files read per folder when 'gitignore' is enabled
+    _DEFAULT_IGNORE_FILES = ('.gitignore', '.ignore')
+
+    # Rough characters per token, used for token estimates and token budgets
+    _CHARS_PER_TOKEN = 3.5
+
+    # Budget priority of files, from show_first/show_last
+    _FIRST_TIER = 0
+    _REGULAR_TIER = 1
+    _LAST_TIER = 2
+
+    # Each read worker may have this many files read ahead of the writer
+    _READ_AHEAD_PER_WORKER = 4
+
+    # Listings, stats and reads in flight at once with 'async_io', sized for high-latency network mounts
+    _DEFAULT_ASYNC_CONCURRENCY = 32
+
+    # Slowest and largest files listed in a profile report
+    _DEFAULT_PROFILE_TOP_N = 10
+
+    # Content sniffing thresholds for files without a known binary extension
+    _DEFAULT_SNIFF_BYTES = 8192
+    _MAX_CONTROL_CHARACTER_RATIO = 0.1
+    _MAX_INVALID_UTF8_RATIO = 0.3
+    _TEXT_BYTES = bytes({7, 8, 9, 10, 11, 12, 13, 27} | set(range(0x20, 0x7f)) | set(range(0x80, 0x100)))
 
     # Class fields
     _blacklist: Dict[str, Set[str]]
@@ -188,6 +725,41 @@ class FolderSerializer:
     _show_first: Dict[str, List[str]]
     _show_last: Dict[str, List[str]]
     _llm_separator: Dict[str, str]
+    _workers: int = 1
+    _cache_config: Dict[str, object] = field(default_factory=dict)
+    _cache: Optional['ContentCache'] = None
+    _binary_sniffing: Dict[str, object] = field(default_factory=dict)
+    _sniff_results: Dict[Tuple, bool] = field(default_factory=dict)
+    _limits: Dict[str, Optional[int]] = field(default_factory=dict)
+    _filters: Optional[FolderFilters] = None
+    _gitignore: Dict[str, object] = field(default_factory=dict)
+    _git_index: Optional[Tuple[Set[str], Set[str]]] = None
+    _mmap_threshold_bytes: int = _DEFAULT_MMAP_THRESHOLD_BYTES
+    _profiling: Dict[str, object] = field(default_factory=dict)
+    _profile: Optional['RunProfile'] = None
+    _shared_scan: Optional['SharedScan'] = None
+    # Files announced to the shared scan and not read through it yet
+    _shared_reads: Set[str] = field(default_factory=set)
+    _output: Dict[str, object] = field(default_factory=dict)
+    _hierarchy_config: Dict[str, object] = field(default_factory=dict)
+    _async_io: Dict[str, object] = field(default_factory=dict)
+    _file_system: LocalFileSystem = field(default_factory=LocalFileSystem)
+    _prefetched_listings: Dict[str, Union[Dict[str, os.DirEntry], OSError]] = field(default_factory=dict)
+    _prefetched_stats: Dict[str, os.stat_result] = field(default_factory=dict)
+    # Set between the async prefetch of a run and the reads of its output
+    _async_pipeline: Optional['AsyncPipeline'] = None
+    _previous_snapshot: Optional[Dict[str, Dict[str, object]]] = None
+    _snapshot_contents: Dict[str, str] = field(default_factory=dict)
+    _snapshot_changes: Dict[str, int] = field(default_factory=dict)
+    _over_budget_files: int = 0
+    _duplicate_files: int = 0
+    _dedup: Dict[str, object] = field(default_factory=dict)
+    _content_hashes: Dict[Tuple, str] = field(default_factory=dict)
+    _transforms: Dict[str, List[Dict[str, object]]] = field(default_factory=dict)
+    _transforms_by_extension: Dict[str, List['LineTransform']] = field(default_factory=dict)
+    _transform_savings: Dict[str, int] = field(default_factory=dict)
+    # Created by __post_init__ only when transforms are configured
+    _transform_lock: Optional['threading.Lock'] = None
     _output_path: str = ""
     _folder_content_as_str: str = ""
     _traversed_files: int = 0
@@ -195,17 +767,25 @@ class FolderSerializer:
     _binary_files: int = 0
     _read_errors: int = 0
     _hierarchy: str = ""
+    _scanned_folder: Optional[FolderEntry] = None
+    _ignored_relative_paths: Set[str] = field(default_factory=set)
+    # Stream for diagnostics printed during a run; None is stdout
+    _log: Optional[TextIO] = None
 
     @classmethod
     def create_from_config(cls, config_path: str) -> 'FolderSerializer':
         # Load config json
         with open(config_path, 'r') as f:
             config = json.load(f)
+        return cls.create_from_dict(config)
 
-        # Convert blacklist / whitelist from list to set
+    @classmethod
+    def create_from_dict(cls, config: Dict[str, object]) -> 'FolderSerializer':
+        """Create serializer from a parsed config. Only 'folder_to_serialize' is required."""
+        # Convert blacklist / whitelist from list to set; missing lists are empty
         for list_type in [cls._BLACKLIST, cls._WHITELIST]:
-            for key in config[list_type]:
-                config[list_type][key] = set(config[list_type][key])
+            lists = config.get(list_type, {})
+            config[list_type] = {key: set(lists.get(key, [])) for key in (cls._CONFIG_EXTENSIONS, cls._CONFIG_FILES, cls._CONFIG_FOLDERS)}
 
         # Set defaults for new optional configs
         show_first = config.get(cls._SHOW_FIRST, {cls._CONFIG_FILES: [], cls._CONFIG_FOLDERS: []})
@@ -220,14 +800,90 @@ class FolderSerializer:
             _show_first=show_first,
             _show_last=show_last,
             _llm_separator=llm_separator,
+            _workers=config.get(cls._WORKERS, 1),
+            _cache_config=config.get(cls._CACHE, {"enabled": False}),
+            _binary_sniffing=config.get(cls._BINARY_SNIFFING, {"enabled": False, "sniff_bytes": cls._DEFAULT_SNIFF_BYTES}),
+            _limits=config.get(cls._LIMITS, {"max_file_bytes": None, "max_total_chars": None, "max_total_tokens": None}),
+            _gitignore=config.get(cls._GITIGNORE, {"enabled": False, "ignore_files": list(cls._DEFAULT_IGNORE_FILES), "use_git_index": False}),
+            _mmap_threshold_bytes=config.get(cls._MMAP_THRESHOLD_BYTES, cls._DEFAULT_MMAP_THRESHOLD_BYTES),
+            _profiling=config.get(cls._PROFILING, {"enabled": False, "top_n": cls._DEFAULT_PROFILE_TOP_N}),
+            _output=config.get(cls._OUTPUT, {"compression": None, "chunk_chars": None, "chunk_tokens": None, "manifest": False}),
+            _hierarchy_config=config.get(cls._HIERARCHY, {"max_depth": None, "max_entries_per_folder": None, "show_sizes": False}),
+            _async_io=config.get(cls._ASYNC_IO, {"enabled": False, "concurrency": cls._DEFAULT_ASYNC_CONCURRENCY}),
+            _dedup=config.get(cls._DEDUP, {"enabled": False, "min_bytes": 1}),
+            _transforms=config.get(cls._TRANSFORMS, {}),
         )
 
-    def print_summary(self) -> None:
-        print(self._hierarchy)
-        print(f"Errors: {self._read_errors}")
-        print(f"Binaries: {self._binary_files}")
-        print(f"Files Read: {self._traversed_files}")
-        print(f"Skipped: {self._skipped_files}")
+    def __post_init__(self) -> None:
+        if self._transforms:
+            # Several read workers add up transform savings; threading is only loaded when that can happen
+            import threading
+            self._transform_lock = threading.Lock()
+
+    def enable_cache(self, cache_folder: str) -> None:
+        """Reuse decoded contents of unchanged files from earlier runs stored in 'cache_folder'"""
+        from folder_serializer_cache import ContentCache
+        self._cache = ContentCache(
+            cache_folder=cache_folder,
+            fingerprint=self._cache_fingerprint(),
+            max_bytes=self._cache_config.get("max_bytes", ContentCache.max_bytes),
+            verify_hash=self._cache_config.get("verify_hash", False),
+        )
+        self._cache.load()
+
+    def enable_profiling(self) -> 'RunProfile':
+        """Time every phase of the following runs. Without this, the only cost is a None check per phase."""
+        if self._profile is None:
+            from folder_serializer_profile import RunProfile
+            self._profile = RunProfile(top_n=self._profiling.get("top_n", self._DEFAULT_PROFILE_TOP_N))
+        return self._profile
+
+    def enable_snapshot_diff(self, manifest_path: str) -> None:
+        """Only write files added, modified or removed since the run that wrote 'manifest_path'"""
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self._previous_snapshot = {file_record["path"]: file_record for file_record in manifest["files"]}
+
+    def use_shared_scan(self, shared_scan: 'SharedScan') -> None:
+        """List folders and read whole files through 'shared_scan', reusing what other serializers of the same root did"""
+        self._shared_scan = shared_scan
+        self._sniff_results = shared_scan.sniff_results
+
+    def add_filters(self, filters: Dict[str, Dict[str, List[str]]]) -> None:
+        """Extend the blacklist / whitelist, e.g. with filters given on the command line"""
+        for list_type, lists in filters.items():
+            target = self._blacklist if list_type == self._BLACKLIST else self._whitelist
+            for key, values in lists.items():
+                target[key] |= set(values)
+        self._filters = None
+
+    def add_file_hook(self, hook: Callable[['FileReport'], None]) -> None:
+        """Call 'hook' in output order for every scanned file. Enables profiling."""
+        self.enable_profiling().file_hooks.append(hook)
+
+    def print_summary(self, file: Optional[TextIO] = None) -> None:
+        """Print the hierarchy and run counters to 'file' (by default stdout, or stderr after a run to stdout)"""
+        file = file or self._log
+        print(self._hierarchy, file=file)
+        print(f"Errors: {self._read_errors}", file=file)
+        print(f"Binaries: {self._binary_files}", file=file)
+        print(f"Files Read: {self._traversed_files}", file=file)
+        print(f"Skipped: {self._skipped_files}", file=file)
+        if self._max_total_chars() is not None:
+            print(f"Over Budget: {self._over_budget_files}", file=file)
+        if self._dedup.get("enabled", False):
+            print(f"Duplicates: {self._duplicate_files}", file=file)
+        for transform_name, saved_bytes in sorted(self._transform_savings.items()):
+            print(f"Saved by {transform_name}: {saved_bytes} bytes", file=file)
+        if self._cache is not None:
+            print(f"Cache Hits: {self._cache.hits}", file=file)
+        if self._previous_snapshot is not None:
+            print(", ".join(f"{change.capitalize()}: {self._snapshot_changes.get(change, 0)}" for change in ("added", "modified", "removed", "unchanged")), file=file)
+        if self._profile is not None:
+            report = self._profile.report()
+            print(f"Total: {report['wall_seconds'] * 1000:.1f} ms wall, {report['cpu_seconds'] * 1000:.1f} ms CPU", file=file)
+            for phase, totals in sorted(self._profile.phases.items(), key=lambda item: -item[1]["wall_seconds"]):
+                print(f"  {phase:<12} {totals['wall_seconds'] * 1000:>10.1f} ms wall {totals['cpu_seconds'] * 1000:>10.1f} ms CPU {totals['calls']:>8} calls", file=file)
 
     def write_output(self, output_path: str) -> None:
         try:
@@ -235,186 +891,1178 @@ class FolderSerializer:
             with open(output_path, 'w', encoding='utf-8') as f:
                 f.write(self._folder_content_as_str)
             print(f"Output successfully written to {output_path}")
-            print(f"Length of output: {len(self._folder_content_as_str)} characters (~{int(len(self._folder_content_as_str) / 3.5)} tokens)\n")
+            print(f"Length of output: {len(self._folder_content_as_str)} characters (~{int(len(self._folder_content_as_str) / self._CHARS_PER_TOKEN)} tokens)\n")
         except Exception as e:
             print(f"Error writing to {output_path} {str(e)}\n")
 
+    def stream_output(self, output_path: str) -> int:
+        """Serialize folder straight into 'output_path' (or stdout if '-') without building the full string.
+
+        Returns the number of characters written, 0 if writing failed.
+        """
+        # Status messages go to stderr when the output itself goes to stdout
+        log = sys.stderr if output_path == self._STDOUT_PATH else sys.stdout
+        # Diagnostics printed during the run must not end up inside the output
+        self._log = sys.stderr if output_path == self._STDOUT_PATH else None
+        try:
+            output_sink = self._create_output_sink(output_path)
+            output_length = self._write_output_to(output_sink)
+            if len(output_sink.paths) > 1:
+                print(f"Output successfully written to {len(output_sink.paths)} parts, {output_sink.paths[0]} to {output_sink.paths[-1]}", file=log)
+            else:
+                print(f"Output successfully written to {output_sink.paths[0]}", file=log)
+            print(f"Length of output: {output_length} characters (~{int(output_length / self._CHARS_PER_TOKEN)} tokens)\n", file=log)
+            if self._output.get("manifest", False) and output_path != self._STDOUT_PATH:
+                output_sink.write_manifest(output_path + self._MANIFEST_SUFFIX, self.folder_to_serialize)
+            if self._profile is not None and output_path != self._STDOUT_PATH:
+                report_path = output_path + self._PROFILE_REPORT_SUFFIX
+                self._profile.write_report(report_path)
+                print(f"Profile written to {report_path}", file=log)
+            return output_length
+        except Exception as e:
+            print(f"Error writing to {output_path} {str(e)}\n", file=log)
+            return 0
+
+    def write_output_stream(self, sink: TextIO) -> int:
+        """Write serialized output piece by piece to 'sink'. Returns the number of characters written."""
+        profile = self._profile
+        output_length = 0
+        for piece in self.iter_serialized_folder():
+            if profile is not None:
+                started = profile.start()
+                sink.write(piece)
+                profile.stop("writing", started)
+            else:
+                sink.write(piece)
+            output_length += len(piece)
+        sink.flush()
+        return output_length
+
+    def write_output_binary(self, sink: BinaryIO) -> int:
+        """Write UTF-8 encoded output to 'sink', copying large valid UTF-8 files without decoding them.
+
+        The bytes are the same as a text mode write of iter_serialized_folder(). Returns the number of characters.
+        """
+        from folder_serializer_output import OutputSink
+        return self._write_output_to(OutputSink(stream=sink))
+
+    def _create_output_sink(self, output_path: str) -> 'OutputSink':
+        from folder_serializer_output import OutputSink
+        compression = self._output.get("compression")
+        if output_path == self._STDOUT_PATH:
+            # Parts need file names, so stdout always gets a single stream
+            sys.stdout.flush()
+            return OutputSink(stream=sys.stdout.buffer, compression=compression, log=sys.stderr)
+        os.makedirs(os.path.dirname(output_path) or os.curdir, exist_ok=True)
+        return OutputSink(
+            output_path=output_path,
+            compression=compression,
+            chunk_chars=self._chunk_chars(),
+            hash_contents=self._output.get("manifest", False),
+        )
+
+    def _chunk_chars(self) -> Optional[int]:
+        """The size limit of one output part in characters, from 'chunk_chars' and/or 'chunk_tokens'"""
+        limits = []
+        if self._output.get("chunk_chars") is not None:
+            limits.append(self._output["chunk_chars"])
+        if self._output.get("chunk_tokens") is not None:
+            limits.append(int(self._output["chunk_tokens"] * self._CHARS_PER_TOKEN))
+        return min(limits) if limits else None
+
+    def _write_output_to(self, output_sink: 'OutputSink') -> int:
+        """Stream every piece into 'output_sink', which decides where each one goes. Returns the number of characters."""
+        import hashlib
+        profile = self._profile
+        use_sendfile = output_sink.writes_raw_file()
+        output_length = 0
+        try:
+            for entry, piece in self._iter_keyed_pieces(self._scan_or_none(), raw_blocks=True):
+                sink = output_sink.open_piece(len(piece), starts_file=entry is not None)
+                started = profile.start() if profile is not None else None
+                content_hash = None
+                if isinstance(piece, RawFileBlock):
+                    prefix = self._encode_output(piece.prefix)
+                    suffix = self._encode_output(piece.suffix)
+                    if output_sink.hash_contents:
+                        content_hash = self._hash_raw_block(piece)
+                    sink.write(prefix)
+                    self._copy_raw_file(piece, sink, use_sendfile)
+                    sink.write(suffix)
+                    written_bytes = len(prefix) + piece.size + len(suffix)
+                    header_bytes, footer_bytes = len(prefix), len(suffix)
+                else:
+                    encoded = self._encode_output(piece)
+                    sink.write(encoded)
+                    written_bytes = len(encoded)
+                    header_bytes = footer_bytes = 0
+                    if entry is not None:
+                        header_bytes = len(self._encode_output(self._block_header(entry.relative_path)))
+                        footer_bytes = len(self._encode_output(self._block_footer(entry.relative_path)))
+                        if output_sink.hash_contents:
+                            content_hash = hashlib.sha256(memoryview(encoded)[header_bytes:written_bytes - footer_bytes]).hexdigest()
+                if profile is not None:
+                    profile.stop("writing", started)
+                    profile.count("bytes_written", written_bytes)
+                output_sink.close_piece(entry, len(piece), written_bytes, header_bytes, written_bytes - header_bytes - footer_bytes, content_hash)
+                output_length += len(piece)
+        finally:
+            output_sink.close()
+        return output_length
+
     def serialize_folder(self) -> None:
+        self._folder_content_as_str = "".join(self.iter_serialized_folder())
+
+    def iter_serialized_folder(self) -> Iterator[str]:
+        """Yield serialized output in order: hierarchy, one block per file, then the LLM separator"""
+        for _, piece in self._iter_keyed_pieces(self._scan_or_none()):
+            yield piece
+
+    def _scan_or_none(self) -> Optional[FolderEntry]:
+        """Scan the tree once; both the hierarchy and the file blocks are produced from it. None if the path is invalid."""
+        if self._profile is not None:
+            self._profile.begin_run()
         if not self.folder_to_serialize or not os.path.exists(self.folder_to_serialize):
+            return None
+        if self._async_pipeline is not None:
+            # Left by a run whose output was never written
+            self._async_pipeline.close()
+            self._async_pipeline = None
+        if self._async_io.get("enabled", False):
+            from folder_serializer_async import AsyncPipeline
+            self._async_pipeline = AsyncPipeline(self, self._async_io.get("concurrency", self._DEFAULT_ASYNC_CONCURRENCY))
+            self._async_pipeline.prefetch_tree()
+        # The prefetch already loaded the git index
+        self._scanned_folder = self._scan_folder(load_git_index=self._async_pipeline is None)
+        # Whatever the scan did not consume (e.g. ignored folders) would be stale by the next run
+        self._prefetched_listings = {}
+        self._prefetched_stats = {}
+        return self._scanned_folder
+
+    def _expect_shared_reads(self) -> None:
+        """Scan once to announce the files this config may read to its shared scan.
+
+        The run reuses this scan's listings, so the extra cost is mostly the filter decisions.
+        """
+        if not self.folder_to_serialize or not os.path.exists(self.folder_to_serialize):
+            return
+        # Scan errors are counted and reported by the run itself
+        log, read_errors = self._log, self._read_errors
+        self._log = io.StringIO()
+        try:
+            scanned_folder = self._scan_folder()
+        finally:
+            self._log, self._read_errors = log, read_errors
+        self._shared_reads = {entry.relative_path for entry in self._iter_files_in_walk_order(scanned_folder) if entry.is_included and not entry.is_binary}
+        self._shared_scan.expect_reads(self._shared_reads)
+
+    def _reset_summary(self) -> None:
+        self._traversed_files = 0
+        self._skipped_files = 0
+        self._binary_files = 0
+        self._read_errors = 0
+        self._over_budget_files = 0
+        self._duplicate_files = 0
+        self._transform_savings = {}
+
+    def _iter_keyed_pieces(self, scanned_folder: Optional[FolderEntry], raw_blocks: bool = False) -> Iterator[Tuple[Optional[FolderEntry], Union[str, RawFileBlock]]]:
+        """Yield (entry, piece) for each output piece. Entry is None for the hierarchy and the LLM separator.
+
+        With 'raw_blocks', large valid UTF-8 files are yielded as RawFileBlock instead of str.
+        """
+        if scanned_folder is None:
             error_msg = f"The path '{self.folder_to_serialize}' does not exist. Go to your config json file and set a valid path.\n"
-            print(error_msg)
-            self._folder_content_as_str = error_msg
+            # Also shown on the console (stderr when the output goes to stdout), not only inside the output
+            print(error_msg, file=self._log)
+            yield None, error_msg
             return
-
-        hierarchy = self._get_hierarchy()
+        if self._previous_snapshot is not None:
+            scanned_folder = self._snapshot_delta(scanned_folder)
+
+        profile = self._profile
+        started = profile.start() if profile is not None else None
+        hierarchy = self._get_hierarchy(scanned_folder)
+        if profile is not None:
+            profile.stop("hierarchy", started)
         hierarchy_with_title = "Folder hierarchy:\n\n" + hierarchy + "\n"
         self._hierarchy = hierarchy_with_title
-        self._folder_content_as_str = hierarchy_with_title
+        separator = self._get_llm_separator()
+
+        # Decide up front which files fit in the budget, so files that would be cut are never read
+        # Duplicates are found first, so the budget counts them at the size of their reference
+        use_dedup = self._dedup.get("enabled", False)
+        if use_dedup:
+            self._mark_duplicates(scanned_folder)
+        max_total_chars = self._max_total_chars()
+        if max_total_chars is not None:
+            self._plan_budget(scanned_folder, max_total_chars - len(hierarchy_with_title) - len(separator))
+            if use_dedup:
+                self._drop_orphaned_duplicates(scanned_folder)
+        yield None, hierarchy_with_title
+
+        files_in_walk_order = self._iter_files_in_walk_order(scanned_folder)
+        for entry, file_content, read_error in self._iter_file_contents(files_in_walk_order, raw_blocks):
+            if not entry.is_included:
+                self._skipped_files += 1
+                if profile is not None:
+                    profile.record_file(entry, "skipped")
+                continue
+            if entry.is_over_budget:
+                self._over_budget_files += 1
+                if profile is not None:
+                    profile.record_file(entry, "over_budget")
+                continue
+
+            if entry.change == "removed":
+                piece = self._format_file_block(entry.relative_path, self._REMOVED_FILE_TEXT)
+                status = "removed"
+            elif entry.is_binary:
+                self._binary_files += 1
+                piece = self._format_file_block(entry.relative_path, "[Binary file - NOT DISPLAYED]")
+                status = "binary"
+            elif entry.duplicate_of is not None:
+                self._duplicate_files += 1
+                piece = self._format_file_block(entry.relative_path, self._duplicate_text(entry))
+                status = "duplicate"
+            elif read_error is not None:
+                self._read_errors += 1
+                file_path = os.path.join(self.folder_to_serialize, entry.relative_path)
+                print(f"Error reading file {file_path}: {str(read_error)}", file=self._log)
+                if profile is not None:
+                    profile.record_file(entry, "error")
+                continue
+            elif isinstance(file_content, RawFileBlock):
+                file_content.prefix = self._block_header(entry.relative_path)
+                file_content.suffix = self._block_footer(entry.relative_path)
+                self._traversed_files += 1
+                piece = file_content
+                status = "copied"
+            else:
+                if len(file_content) == 0:
+                    file_content = "[Empty file - NOTHING TO DISPLAY]"
+                self._traversed_files += 1
+                piece = self._format_file_block(entry.relative_path, file_content)
+                status = "read"
+            if profile is not None:
+                profile.record_file(entry, status, len(piece))
+            yield entry, piece
 
-        for root, dirs, files in os.walk(self.folder_to_serialize):
-            # Filter and sort folders
-            filtered_dirs = [d for d in dirs if self._should_process_folder(d)]
-            dirs[:] = self._sort_items(filtered_dirs, self._CONFIG_FOLDERS)
+        # Add LLM separator if enabled
+        if separator:
+            yield None, separator
+
+        if self._cache is not None:
+            self._cache.save()
+        if profile is not None:
+            profile.end_run()
+
+    def _get_llm_separator(self) -> str:
+        if not self._llm_separator.get("enabled", False):
+            return ""
+        separator_text = self._llm_separator.get("text", "--- End of Code / Start of Instructions ---")
+        return f"\n\n{separator_text}\n\n"
+
+    def _max_total_chars(self) -> Optional[int]:
+        """The global output budget in characters, from 'max_total_chars' and/or 'max_total_tokens'"""
+        budgets = []
+        if self._limits.get("max_total_chars") is not None:
+            budgets.append(self._limits["max_total_chars"])
+        if self._limits.get("max_total_tokens") is not None:
+            budgets.append(int(self._limits["max_total_tokens"] * self._CHARS_PER_TOKEN))
+        return min(budgets) if budgets else None
+
+    def _plan_budget(self, scanned_folder: FolderEntry, remaining_chars: int) -> None:
+        """Mark files as over budget, filling the budget by priority: show_first, then regular, then show_last.
+
+        File sizes in bytes are an upper bound on their decoded length, so files that are kept always fit.
+        A file that does not fit is skipped, and smaller files after it still get the rest of the budget.
+        Every file is marked again on each plan, since watch mode keeps entries across rescans.
+        """
+        tiers: List[List[FolderEntry]] = [[], [], []]
+        self._collect_priority_tiers(scanned_folder, self._REGULAR_TIER, tiers)
+        for tier in tiers:
+            for entry in tier:
+                estimated_length = self._estimate_block_length(entry)
+                entry.is_over_budget = estimated_length > remaining_chars
+                if not entry.is_over_budget:
+                    remaining_chars -= estimated_length
+
+    def _collect_priority_tiers(self, folder: FolderEntry, folder_tier: int, tiers: List[List[FolderEntry]]) -> None:
+        for entry in folder.files:
+            if entry.is_included:
+                tiers[self._priority_tier(entry.name, self._CONFIG_FILES, folder_tier)].append(entry)
+        for subfolder in folder.folders:
+            if subfolder.is_included:
+                self._collect_priority_tiers(subfolder, self._priority_tier(subfolder.name, self._CONFIG_FOLDERS, folder_tier), tiers)
+
+    def _priority_tier(self, name: str, item_type: str, inherited_tier: int) -> int:
+        names = [name, os.path.splitext(name)[0]] if item_type == self._CONFIG_FILES else [name]
+        if any(item in self._show_first.get(item_type, []) for item in names):
+            return self._FIRST_TIER
+        if any(item in self._show_last.get(item_type, []) for item in names):
+            return self._LAST_TIER
+        return inherited_tier
+
+    def _estimate_block_length(self, entry: FolderEntry) -> int:
+        """Upper bound on the length of an entry's block, using only metadata from the scan"""
+        if entry.change == "removed":
+            return len(self._format_file_block(entry.relative_path, self._REMOVED_FILE_TEXT))
+        if entry.duplicate_of is not None:
+            return len(self._format_file_block(entry.relative_path, self._duplicate_text(entry)))
+        if entry.is_binary:
+            return len(self._format_file_block(entry.relative_path, "[Binary file - NOT DISPLAYED]"))
+        if entry.size == 0:
+            return len(self._format_file_block(entry.relative_path, "[Empty file - NOTHING TO DISPLAY]"))
+        content_length = entry.size
+        max_file_bytes = self._limits.get("max_file_bytes")
+        if max_file_bytes is not None and entry.size > max_file_bytes:
+            content_length = max_file_bytes + len(self._truncation_marker(entry.size - max_file_bytes))
+        return len(self._format_file_block(entry.relative_path, "")) + content_length
+
+    def _iter_file_contents(self, entries: Iterator[FolderEntry], raw_blocks: bool = False) -> Iterator[Tuple[FolderEntry, Union[str, RawFileBlock], Optional[Exception]]]:
+        """Yield (entry, content, error) in the order of 'entries', reading files on a thread pool if workers > 1"""
+        if self._async_io.get("enabled", False):
+            # The pipeline of this run's prefetch holds the reads it already started
+            pipeline, self._async_pipeline = self._async_pipeline, None
+            if pipeline is None:
+                from folder_serializer_async import AsyncPipeline
+                pipeline = AsyncPipeline(self, self._async_io.get("concurrency", self._DEFAULT_ASYNC_CONCURRENCY))
+            yield from pipeline.iter_file_contents(entries, raw_blocks)
+            return
+        if self._workers <= 1:
+            for entry in entries:
+                yield (entry, *self._read_entry(entry, raw_blocks))
+            return
 
-            # Sort files according to show_first/show_last rules
-            sorted_files = self._sort_items(files, self._CONFIG_FILES)
+        # Reads run ahead of the writer, but never by more than a fixed number of files
+        max_in_flight = self._workers * self._READ_AHEAD_PER_WORKER
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            in_flight = deque()
+            for entry in entries:
+                if self._needs_read(entry):
+                    in_flight.append((entry, executor.submit(self._read_entry, entry, raw_blocks)))
+                else:
+                    in_flight.append((entry, None))
+                while len(in_flight) >= max_in_flight:
+                    yield self._resolve_read(*in_flight.popleft())
+            while in_flight:
+                yield self._resolve_read(*in_flight.popleft())
 
-            for file in sorted_files:
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, self.folder_to_serialize)
+    @staticmethod
+    def _resolve_read(entry: FolderEntry, future) -> Tuple[FolderEntry, str, Optional[Exception]]:
+        if future is None:
+            return entry, "", None
+        return (entry, *future.result())
 
-                if not self._should_process_file(file):
-                    self._skipped_files += 1
-                    continue
+    @staticmethod
+    def _needs_read(entry: FolderEntry) -> bool:
+        return (entry.is_included and not entry.is_binary and not entry.is_over_budget
+                and entry.change != "removed" and entry.duplicate_of is None)
+
+    def _read_entry(self, entry: FolderEntry, raw_blocks: bool = False) -> Tuple[Union[str, RawFileBlock], Optional[Exception]]:
+        """Read one file as text. Errors are returned rather than raised so they can be counted in order."""
+        if not self._needs_read(entry):
+            return "", None
+        if self._profile is None:
+            return self._read_file(entry, raw_blocks)
+        started = time.perf_counter()
+        result = self._read_file(entry, raw_blocks)
+        self._profile.record_read_time(entry.relative_path, time.perf_counter() - started)
+        return result
+
+    def _read_file(self, entry: FolderEntry, raw_blocks: bool) -> Tuple[Union[str, RawFileBlock], Optional[Exception]]:
+        profile = self._profile
+        if self._snapshot_contents:
+            # Already read to compare it with the snapshot
+            snapshot_content = self._snapshot_contents.pop(entry.relative_path, None)
+            if snapshot_content is not None:
+                return snapshot_content, None
+        file_path = os.path.join(self.folder_to_serialize, entry.relative_path)
+        if raw_blocks and self._can_copy_raw(entry):
+            started = profile.start() if profile is not None else None
+            try:
+                raw_block = self._open_raw_block(file_path)
+            except Exception as e:
+                return "", e
+            if profile is not None:
+                profile.stop("utf8_check", started)
+            if raw_block is not None:
+                return raw_block, None
+        if self._cache is not None:
+            started = profile.start() if profile is not None else None
+            cached_content = self._cache.lookup(entry, file_path)
+            if profile is not None:
+                profile.stop("cache_lookup", started)
+            if cached_content is not None:
+                return cached_content, None
+        try:
+            max_file_bytes = self._limits.get("max_file_bytes")
+            transforms = self._transforms_for(entry.name) if self._transforms else None
+            if transforms:
+                file_content, raw_content = self._read_transformed(entry, file_path, transforms)
+                if self._cache is not None:
+                    self._cache.store(entry, file_content, raw_content)
+            elif max_file_bytes is not None and entry.size > max_file_bytes:
+                # Only the part that will be shown is read
+                with self._file_system.open(file_path, 'rb') as f:
+                    raw_content = f.read(max_file_bytes)
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                file_content = self._normalize_newlines(decoder.decode(raw_content, final=False))
+                file_content += self._truncation_marker(entry.size - len(raw_content))
+                if self._cache is not None:
+                    self._cache.store(entry, file_content)
+            elif self._cache is not None and self._cache.verify_hash:
+                # The raw bytes are needed for the hash, so decode them the same way text mode would
+                with self._file_system.open(file_path, 'rb') as f:
+                    raw_content = f.read()
+                file_content = self._decode_text(raw_content)
+                self._cache.store(entry, file_content, raw_content)
+            elif self._shared_scan is not None:
+                self._shared_reads.discard(entry.relative_path)
+                file_content = self._shared_scan.read_text(entry, file_path)
+                if self._cache is not None:
+                    self._cache.store(entry, file_content)
+            elif profile is not None:
+                # Reading and decoding are timed apart; the content is the same as from a text mode read
+                started = profile.start()
+                with self._file_system.open(file_path, 'rb') as f:
+                    raw_content = f.read()
+                profile.stop("reading", started)
+                started = profile.start()
+                file_content = self._decode_text(raw_content)
+                profile.stop("decoding", started)
+                if self._cache is not None:
+                    self._cache.store(entry, file_content)
+            else:
+                with self._file_system.open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    file_content = f.read()
+                if self._cache is not None:
+                    self._cache.store(entry, file_content)
+            return file_content, None
+        except Exception as e:
+            return "", e
+
+    def _read_transformed(self, entry: FolderEntry, file_path: str, transforms: List['LineTransform']) -> Tuple[str, Optional[bytes]]:
+        """Stream a file line by line through its transforms. The raw bytes are returned only if the cache hashes them."""
+        max_file_bytes = self._limits.get("max_file_bytes")
+        raw_content = None
+        omitted_bytes = 0
+        with contextlib.ExitStack() as stack:
+            if max_file_bytes is not None and entry.size > max_file_bytes:
+                with self._file_system.open(file_path, 'rb') as f:
+                    truncated_content = f.read(max_file_bytes)
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                lines = io.StringIO(self._normalize_newlines(decoder.decode(truncated_content, final=False)))
+                omitted_bytes = entry.size - len(truncated_content)
+            elif self._cache is not None and self._cache.verify_hash:
+                with self._file_system.open(file_path, 'rb') as f:
+                    raw_content = f.read()
+                lines = io.StringIO(self._decode_text(raw_content))
+            else:
+                # Text mode iterates lines with the same newline handling as a full read
+                lines = stack.enter_context(self._file_system.open(file_path, 'r', encoding='utf-8', errors='replace'))
+            file_content = self._apply_transforms(lines, transforms)
+        if omitted_bytes:
+            file_content += self._truncation_marker(omitted_bytes)
+        return file_content, raw_content
+
+    def _apply_transforms(self, lines: Iterable[str], transforms: List['LineTransform']) -> str:
+        # line_bytes[i] counts the bytes going into transform i; the last slot counts what comes out
+        line_bytes = [0] * (len(transforms) + 1)
+        stream = self._count_line_bytes(lines, line_bytes, 0)
+        for index, transform in enumerate(transforms):
+            stream = self._count_line_bytes(transform.apply(stream), line_bytes, index + 1)
+        file_content = "".join(stream)
+        with self._transform_lock:
+            for index, transform in enumerate(transforms):
+                self._transform_savings[transform.name] = self._transform_savings.get(transform.name, 0) + line_bytes[index] - line_bytes[index + 1]
+        return file_content
 
-                file_extension = os.path.splitext(file)[-1].lower()
-                if file_extension in self.BINARY_FILE_EXTENSIONS:
-                    self._folder_content_as_str += f"\n\n--- Start of File: {relative_path} ---\n\n"
-                    self._folder_content_as_str += "[Binary file - NOT DISPLAYED]"
-                    self._folder_content_as_str += f"\n\n--- End of File: {relative_path} ---\n\n"
-                    self._binary_files += 1
+    @staticmethod
+    def _count_line_bytes(lines: Iterable[str], line_bytes: List[int], index: int) -> Iterator[str]:
+        for line in lines:
+            line_bytes[index] += len(line) if line.isascii() else len(line.encode('utf-8'))
+            yield line
+
+    def _transforms_for(self, file_name: str) -> List['LineTransform']:
+        """The configured transforms of a file's extension, built once per extension"""
+        extension = os.path.splitext(file_name)[1].lower()
+        transforms = self._transforms_by_extension.get(extension)
+        if transforms is None:
+            specs = self._transforms.get(self._ALL_EXTENSIONS, []) + self._transforms.get(extension, [])
+            from folder_serializer_transforms import LineTransform
+            transforms = [LineTransform.create(spec, extension) for spec in specs]
+            self._transforms_by_extension[extension] = transforms
+        return transforms
+
+    def _can_copy_raw(self, entry: FolderEntry) -> bool:
+        """Large files may skip decoding when nothing would change their bytes on the way to the output"""
+        if entry.size < self._mmap_threshold_bytes or os.linesep != '\n':
+            return False
+        if self._transforms and self._transforms_for(entry.name):
+            return False
+        max_file_bytes = self._limits.get("max_file_bytes")
+        return max_file_bytes is None or entry.size <= max_file_bytes
+
+    def _open_raw_block(self, file_path: str) -> Optional[RawFileBlock]:
+        """Map the file and check that it is valid UTF-8 without CR characters; None means it must be decoded.
+
+        The file stays open, so the bytes that were checked are the bytes that get copied.
+        """
+        import mmap
+        f = self._file_system.open(file_path, 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                f.close()
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Text mode would turn CR and CRLF into LF, so those files go through the decoding path
+                if mapped.find(b'\r') != -1:
+                    f.close()
+                    return None
+                length = self._utf8_length(mapped, size)
+        except Exception:
+            f.close()
+            raise
+        if length is None:
+            f.close()
+            return None
+        return RawFileBlock(file=f, size=size, length=length)
+
+    @classmethod
+    def _utf8_length(cls, mapped: 'mmap.mmap', size: int) -> Optional[int]:
+        """Number of characters if the bytes are valid UTF-8, else None. Works in bounded chunks."""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='strict')
+        length = 0
+        try:
+            for offset in range(0, size, cls._UTF8_CHECK_CHUNK_BYTES):
+                chunk = mapped[offset:offset + cls._UTF8_CHECK_CHUNK_BYTES]
+                # Pure ASCII chunks are valid and one character per byte, no decoding needed
+                if chunk.isascii() and not decoder.getstate()[0]:
+                    length += len(chunk)
                 else:
-                    try:
-                        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                            self._folder_content_as_str += f"\n\n--- Start of File: {relative_path} ---\n\n"
-                            file_content = f.read()
-                            if len(file_content) == 0:
-                                self._folder_content_as_str += "[Empty file - NOTHING TO DISPLAY]"
-                            else:
-                                self._folder_content_as_str += file_content
-                            self._folder_content_as_str += f"\n\n--- End of File: {relative_path} ---\n\n"
-                            self._traversed_files += 1
-                    except Exception as e:
-                        self._read_errors += 1
-                        print(f"Error reading file {file_path}: {str(e)}")
+                    length += len(decoder.decode(chunk))
+            length += len(decoder.decode(b'', final=True))
+        except UnicodeDecodeError:
+            return None
+        return length
 
-        # Add LLM separator if enabled
-        if self._llm_separator.get("enabled", False):
-            separator_text = self._llm_separator.get("text", "--- End of Code / Start of Instructions ---")
-            self._folder_content_as_str += f"\n\n{separator_text}\n\n"
+    @staticmethod
+    def _copy_raw_file(raw_block: RawFileBlock, sink: BinaryIO, use_sendfile: bool = True) -> None:
+        """Copy a file into 'sink' with os.sendfile when possible, otherwise through the memory map.
+
+        'use_sendfile' must be False when 'sink' transforms what is written to it, e.g. compresses it.
+        """
+        import mmap
+        with raw_block.file:
+            sink.flush()
+            copied = 0
+            if use_sendfile and hasattr(os, 'sendfile'):
+                try:
+                    sink_fd = sink.fileno()
+                    while copied < raw_block.size:
+                        sent = os.sendfile(sink_fd, raw_block.file.fileno(), copied, raw_block.size - copied)
+                        if sent == 0:
+                            break
+                        copied += sent
+                except (OSError, ValueError, AttributeError):
+                    pass
+            if copied < raw_block.size:
+                with mmap.mmap(raw_block.file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    sink.write(memoryview(mapped)[copied:raw_block.size])
+
+    @staticmethod
+    def _hash_raw_block(raw_block: RawFileBlock) -> str:
+        """SHA-256 of a file that is copied as is; its bytes are the block's content"""
+        import mmap
+        import hashlib
+        with mmap.mmap(raw_block.file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(memoryview(mapped)[:raw_block.size]).hexdigest()
+
+    @staticmethod
+    def _encode_output(text: str) -> bytes:
+        """Encode like a text mode write would, including the platform's newline translation"""
+        if os.linesep != '\n':
+            text = text.replace('\n', os.linesep)
+        return text.encode('utf-8')
+
+    @staticmethod
+    def _decode_text(raw_content: bytes) -> str:
+        """Decode bytes exactly like open(..., 'r', encoding='utf-8', errors='replace') with universal newlines"""
+        return FolderSerializer._normalize_newlines(raw_content.decode('utf-8', errors='replace'))
+
+    @staticmethod
+    def _normalize_newlines(text: str) -> str:
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+    @staticmethod
+    def _truncation_marker(omitted_bytes: int) -> str:
+        return f"\n\n[Truncated - {omitted_bytes} more bytes NOT DISPLAYED]"
+
+    def _cache_fingerprint(self) -> str:
+        """Anything that changes which files are shown, or how, must change this fingerprint"""
+        import hashlib
+        def normalize(rules: Dict[str, Set[str]]) -> Dict[str, List[str]]:
+            return {key: sorted(values) for key, values in rules.items()}
+        settings = {
+            # Keys are relative paths, so contents of another root must never match
+            self._FOLDER_TO_SERIALIZE: os.path.realpath(self.folder_to_serialize),
+            self._BLACKLIST: normalize(self._blacklist),
+            self._WHITELIST: normalize(self._whitelist),
+            self._SHOW_FIRST: self._show_first,
+            self._SHOW_LAST: self._show_last,
+            self._BINARY_SNIFFING: self._binary_sniffing,
+            self._LIMITS: self._limits,
+            self._GITIGNORE: self._gitignore,
+            self._TRANSFORMS: self._transforms,
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _format_file_block(relative_path: str, file_content: str) -> str:
+        return FolderSerializer._block_header(relative_path) + file_content + FolderSerializer._block_footer(relative_path)
+
+    @staticmethod
+    def _block_header(relative_path: str) -> str:
+        return f"\n\n--- Start of File: {relative_path} ---\n\n"
+
+    @staticmethod
+    def _block_footer(relative_path: str) -> str:
+        return f"\n\n--- End of File: {relative_path} ---\n\n"
 
     def _sort_items(self, items: List[str], item_type: str) -> List[str]:
         """Sort items according to show_first and show_last rules"""
-        show_first = self._show_first.get(item_type, [])
-        show_last = self._show_last.get(item_type, [])
+        first_positions = self._rule_positions(self._show_first.get(item_type, []))
+        last_positions = self._rule_positions(self._show_last.get(item_type, []))
 
         first_items = []
         last_items = []
         regular_items = []
 
         for item in items:
-            # For files, check both full name and name without extension
+            # For files, check both full name and name without extension (e.g. hello_world)
             # For folders, only check the folder name
-            matches_first = False
-            matches_last = False
-
-            if item_type == self._CONFIG_FILES:
-                item_name_no_ext = os.path.splitext(item)[0]
-                # Check if the item exactly matches or if the name without extension exactly matches
-                matches_first = item in show_first or item_name_no_ext in show_first
-                matches_last = item in show_last or item_name_no_ext in show_last
-            else:
-                matches_first = item in show_first
-                matches_last = item in show_last
-
-            if matches_first:
-                first_items.append(item)
-            elif matches_last:
-                last_items.append(item)
+            position = first_positions.get(item)
+            if position is None and item_type == self._CONFIG_FILES and first_positions:
+                position = first_positions.get(os.path.splitext(item)[0])
+            if position is not None:
+                first_items.append((position, item))
+                continue
+
+            position = last_positions.get(item)
+            if position is None and item_type == self._CONFIG_FILES and last_positions:
+                position = last_positions.get(os.path.splitext(item)[0])
+            if position is not None:
+                last_items.append((position, item))
             else:
                 regular_items.append(item)
 
         # Sort each group to maintain consistent ordering within groups
-        # but preserve the order specified in show_first/show_last lists
-        def get_priority_index(item_list, target_item):
-            if target_item in item_list:
-                return item_list.index(target_item)
-            if item_type == self._CONFIG_FILES:
-                name_no_ext = os.path.splitext(target_item)[0]
-                if name_no_ext in item_list:
-                    return item_list.index(name_no_ext)
-            return len(item_list)
-
-        first_items.sort(key=lambda x: get_priority_index(show_first, x))
-        last_items.sort(key=lambda x: get_priority_index(show_last, x))
+        # but preserve the order specified in show_first/show_last lists (sort is stable)
+        first_items.sort(key=lambda positioned_item: positioned_item[0])
+        last_items.sort(key=lambda positioned_item: positioned_item[0])
         regular_items.sort()
 
-        return first_items + regular_items + last_items
+        return [item for _, item in first_items] + regular_items + [item for _, item in last_items]
+
+    @staticmethod
+    def _rule_positions(rule_list: List[str]) -> Dict[str, int]:
+        positions = {}
+        for position, item in enumerate(rule_list):
+            positions.setdefault(item, position)
+        return positions
+
+    def _scan_folder(self, load_git_index: bool = True) -> FolderEntry:
+        """Scan 'folder_to_serialize' in a single os.scandir pass and record every filter decision"""
+        folder_name = os.path.basename(self.folder_to_serialize)
+        if load_git_index and self._gitignore.get("enabled", False) and self._gitignore.get("use_git_index", False):
+            self._git_index = self._load_git_index()
+        root = FolderEntry(name=folder_name, relative_path="", is_dir=True, is_included=self._should_process_folder(folder_name))
+
+        # Like os.walk, the root is always scanned even if its own name is filtered out
+        self._scan_children(root, self.folder_to_serialize, ignore_rules=[])
+        return root
+
+    def _scan_children(self, folder: FolderEntry, folder_path: str, ignore_rules: Optional[List[Tuple[str, FilterMatcher]]] = None) -> None:
+        """Scan one folder and recurse. 'ignore_rules' are the .gitignore rules of its ancestors; None rebuilds them."""
+        profile = self._profile
+        started = profile.start() if profile is not None else None
+        try:
+            dir_entries = self._list_folder(folder.relative_path, folder_path)
+        except OSError as e:
+            self._read_errors += 1
+            print(f"Error scanning folder {folder_path}: {str(e)}", file=self._log)
+            return
+        if profile is not None:
+            profile.stop("listing", started)
+            started = profile.start()
+
+        use_gitignore = self._gitignore.get("enabled", False)
+        if use_gitignore:
+            if ignore_rules is None:
+                # Scanning starts below the root (e.g. a watch rescan), so rebuild what the ancestors would have passed down
+                ignore_rules = self._inherited_ignore_rules(folder.relative_path)
+            ignore_rules = ignore_rules + self._load_ignore_rules(folder.relative_path, dir_entries)
+
+        if self._ignored_relative_paths:
+            for name in list(dir_entries):
+                if os.path.join(folder.relative_path, name) in self._ignored_relative_paths:
+                    del dir_entries[name]
+
+        folder_names = []
+        file_names = []
+        for name in sorted(dir_entries):
+            # DirEntry caches the file type from the directory listing, so this costs no extra stat
+            dir_entry = dir_entries[name]
+            try:
+                is_dir = dir_entry.is_dir()
+                is_file = not is_dir and dir_entry.is_file()
+            except OSError:
+                continue
+            # Ignored entries are dropped before they are stat'ed or, for folders, listed
+            if use_gitignore and self._is_gitignored(os.path.join(folder.relative_path, name), name, is_dir, ignore_rules):
+                continue
+            if is_dir:
+                folder_names.append(name)
+            elif is_file:
+                file_names.append(name)
+
+        filters = self._get_filters()
+        needs_totals = self._hierarchy_needs_totals()
+        children = []
+        for name in self._sort_items(folder_names, self._CONFIG_FOLDERS):
+            relative_path = os.path.join(folder.relative_path, name)
+            children.append(FolderEntry(
+                name=name,
+                relative_path=relative_path,
+                is_dir=True,
+                is_included=filters.should_process_folder(name, relative_path),
+            ))
+        if profile is not None:
+            # Ignore files, gitignore matching, sorting and folder decisions
+            profile.stop("filtering", started)
+
+        for child in children:
+            dir_entry = dir_entries[child.name]
+            folder.folders.append(child)
+            # Symlinked folders are listed but never followed, which also rules out cycles
+            if child.is_included and not dir_entry.is_symlink():
+                self._scan_children(child, dir_entry.path, ignore_rules if use_gitignore else [])
+
+        for name in self._sort_items(file_names, self._CONFIG_FILES):
+            dir_entry = dir_entries[name]
+            started = profile.start() if profile is not None else None
+            relative_path = os.path.join(folder.relative_path, name)
+            is_included, is_binary = filters.file_decision(name, relative_path)
+            if profile is not None:
+                profile.stop("filtering", started)
+
+            # Names decide first; excluded files are only stat'ed when the hierarchy totals count their sizes
+            stat_result = None
+            if is_included or needs_totals:
+                started = profile.start() if profile is not None else None
+                try:
+                    stat_result = self._stat_entry(dir_entry)
+                except OSError:
+                    pass
+                if profile is not None:
+                    profile.stop("stat", started)
+
+            # Files that pass the name rules may still be binary; peek at their first bytes before any full read
+            if is_included and not is_binary and stat_result is not None and self._binary_sniffing.get("enabled", False):
+                started = profile.start() if profile is not None else None
+                is_binary = self._sniff_is_binary(dir_entry.path, stat_result)
+                if profile is not None:
+                    profile.stop("sniffing", started)
+
+            folder.files.append(FolderEntry(
+                name=name,
+                relative_path=relative_path,
+                is_dir=False,
+                size=stat_result.st_size if stat_result is not None else 0,
+                mtime_ns=stat_result.st_mtime_ns if stat_result is not None else 0,
+                is_included=is_included,
+                is_binary=is_binary,
+            ))
+
+    def _list_folder(self, relative_path: str, folder_path: str) -> Dict[str, os.DirEntry]:
+        """Entries of one folder by name, from the async prefetch or a shared scan if there is one"""
+        if self._prefetched_listings:
+            listing = self._prefetched_listings.pop(relative_path, None)
+            if isinstance(listing, OSError):
+                raise listing
+            if listing is not None:
+                return listing
+        if self._shared_scan is not None:
+            return self._shared_scan.list_folder(relative_path, folder_path)
+        return self._file_system.scandir(folder_path)
+
+    def _stat_entry(self, dir_entry: os.DirEntry) -> os.stat_result:
+        if self._prefetched_stats:
+            stat_result = self._prefetched_stats.pop(dir_entry.path, None)
+            if stat_result is not None:
+                return stat_result
+        return self._file_system.stat(dir_entry)
+
+    def _load_ignore_rules(self, relative_path: str, dir_entries: Dict[str, os.DirEntry]) -> List[Tuple[str, FilterMatcher]]:
+        """Compile the ignore files of one folder; the listing tells us which exist without extra stat calls"""
+        rules = []
+        for ignore_file in self._gitignore.get("ignore_files", self._DEFAULT_IGNORE_FILES):
+            if ignore_file in dir_entries:
+                try:
+                    patterns = FilterMatcher.read_ignore_file(dir_entries[ignore_file].path)
+                except OSError:
+                    continue
+                rules.append((relative_path, FilterMatcher.compile(patterns, keep_order=True)))
+        return rules
+
+    def _inherited_ignore_rules(self, relative_path: str) -> List[Tuple[str, FilterMatcher]]:
+        if self._gitignore.get("use_git_index", False):
+            self._git_index = self._load_git_index()
+        ancestors = [""]
+        parts = relative_path.split(os.sep) if relative_path else []
+        for depth in range(1, len(parts)):
+            ancestors.append(os.path.join(*parts[:depth]))
+        if not parts:
+            ancestors = []
+
+        rules = []
+        for ancestor in ancestors:
+            for ignore_file in self._gitignore.get("ignore_files", self._DEFAULT_IGNORE_FILES):
+                try:
+                    patterns = FilterMatcher.read_ignore_file(os.path.join(self.folder_to_serialize, ancestor, ignore_file))
+                except OSError:
+                    continue
+                rules.append((ancestor, FilterMatcher.compile(patterns, keep_order=True)))
+        return rules
+
+    def _is_gitignored(self, relative_path: str, name: str, is_dir: bool, ignore_rules: List[Tuple[str, FilterMatcher]]) -> bool:
+        path = relative_path.replace(os.sep, "/")
+        if self._git_index is not None:
+            tracked_files, tracked_folders = self._git_index
+            return path not in (tracked_folders if is_dir else tracked_files)
+
+        # Rules from deeper ignore files come later and override those of their ancestors
+        is_ignored = None
+        for base, matcher in ignore_rules:
+            base_path = base.replace(os.sep, "/")
+            path_from_base = path[len(base_path) + 1:] if base_path else path
+            state = matcher.match_state(name, path_from_base, is_dir)
+            if state is not None:
+                is_ignored = state
+        return bool(is_ignored)
+
+    def _load_git_index(self) -> Optional[Tuple[Set[str], Set[str]]]:
+        """Use 'git ls-files' as a precomputed list of non-ignored files. None if this is not a git work tree."""
+        import subprocess
+        try:
+            result = subprocess.run(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+                cwd=self.folder_to_serialize, capture_output=True, check=True,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        tracked_files = set()
+        tracked_folders = set()
+        for path in os.fsdecode(result.stdout).split("\0"):
+            if not path:
+                continue
+            tracked_files.add(path)
+            folder = os.path.dirname(path)
+            while folder and folder not in tracked_folders:
+                tracked_folders.add(folder)
+                folder = os.path.dirname(folder)
+        return tracked_files, tracked_folders
+
+    def _sniff_is_binary(self, file_path: str, stat_result: os.stat_result) -> bool:
+        """Classify a file as binary from its first 'sniff_bytes' bytes. Results are remembered per file identity."""
+        identity = (file_path, stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+        is_binary = self._sniff_results.get(identity)
+        if is_binary is None:
+            try:
+                with self._file_system.open(file_path, 'rb') as f:
+                    sample = f.read(self._binary_sniffing.get("sniff_bytes", self._DEFAULT_SNIFF_BYTES))
+            except OSError:
+                # Unreadable files are left to the normal read path, which reports the error
+                return False
+            is_binary = self._looks_binary(sample)
+            self._sniff_results[identity] = is_binary
+        return is_binary
 
-    def _get_hierarchy(self, current_path: str = "", prefix: str = "") -> str:
+    @classmethod
+    def _looks_binary(cls, sample: bytes) -> bool:
+        if not sample:
+            return False
+        if b"\0" in sample:
+            return True
+
+        # Control characters other than common whitespace/escape codes are rare in text
+        control_characters = len(sample.translate(None, cls._TEXT_BYTES))
+        if control_characters / len(sample) > cls._MAX_CONTROL_CHARACTER_RATIO:
+            return True
+
+        # Invalid UTF-8 sequences; a multi-byte character cut off by the sample boundary is not counted
+        decoded = codecs.getincrementaldecoder('utf-8')(errors='replace').decode(sample, final=False)
+        invalid_sequences = decoded.count("\ufffd") - sample.count("\ufffd".encode('utf-8'))
+        return invalid_sequences / len(sample) > cls._MAX_INVALID_UTF8_RATIO
+
+    def _snapshot_delta(self, scanned_folder: FolderEntry) -> FolderEntry:
+        """A copy of the scanned tree with only the files added, modified or removed since the snapshot.
+
+        Size and mtime decide first; only files with the same size but a new mtime are read and hashed.
+        Removed files are put back at their old place, creating their folders if those are gone too.
+        """
+        self._snapshot_changes = {}
+        self._snapshot_contents = {}
+        current_paths: Set[str] = set()
+        delta = self._snapshot_delta_folder(scanned_folder, current_paths)
+        if delta is None:
+            delta = replace(scanned_folder, folders=[], files=[])
+
+        for relative_path, file_record in self._previous_snapshot.items():
+            if relative_path in current_paths:
+                continue
+            folder = delta
+            parts = relative_path.split(os.sep)
+            for depth, name in enumerate(parts[:-1]):
+                subfolder = next((child for child in folder.folders if child.name == name), None)
+                if subfolder is None:
+                    subfolder = FolderEntry(name=name, relative_path=os.path.join(*parts[:depth + 1]), is_dir=True)
+                    folder.folders.append(subfolder)
+                folder = subfolder
+            folder.files.append(FolderEntry(
+                name=parts[-1],
+                relative_path=relative_path,
+                is_dir=False,
+                size=file_record.get("size", 0),
+                change="removed",
+            ))
+            self._snapshot_changes["removed"] = self._snapshot_changes.get("removed", 0) + 1
+        return delta
+
+    def _snapshot_delta_folder(self, folder: FolderEntry, current_paths: Set[str]) -> Optional[FolderEntry]:
+        """Changed files of one included folder and its subfolders; None if nothing in it changed"""
+        files = []
+        for entry in folder.files:
+            if not entry.is_included:
+                continue
+            current_paths.add(entry.relative_path)
+            change = self._snapshot_change(entry)
+            self._snapshot_changes[change or "unchanged"] = self._snapshot_changes.get(change or "unchanged", 0) + 1
+            if change is not None:
+                files.append(replace(entry, change=change))
+        folders = []
+        for subfolder in folder.folders:
+            if subfolder.is_included:
+                delta = self._snapshot_delta_folder(subfolder, current_paths)
+                if delta is not None:
+                    folders.append(delta)
+        if not files and not folders:
+            return None
+        return replace(folder, folders=folders, files=files)
+
+    def _snapshot_change(self, entry: FolderEntry) -> Optional[str]:
+        file_record = self._previous_snapshot.get(entry.relative_path)
+        if file_record is None:
+            return "added"
+        if file_record.get("size") != entry.size or file_record.get("binary", False) != entry.is_binary:
+            return "modified"
+        if file_record.get("mtime_ns") == entry.mtime_ns:
+            return None
+        # Touched but possibly unchanged; binary files have no content hash to compare
+        if entry.is_binary or not file_record.get("sha256"):
+            return "modified"
+        file_content, read_error = self._read_file(entry, raw_blocks=False)
+        if read_error is not None:
+            return "modified"
+        import hashlib
+        shown_content = file_content if len(file_content) > 0 else "[Empty file - NOTHING TO DISPLAY]"
+        if hashlib.sha256(self._encode_output(shown_content)).hexdigest() == file_record["sha256"]:
+            return None
+        self._snapshot_contents[entry.relative_path] = file_content
+        return "modified"
+
+    def _mark_duplicates(self, scanned_folder: FolderEntry) -> None:
+        """Point later copies of a file's content at its first occurrence in walk order.
+
+        Files are grouped by size first; only files that share their size with another file are hashed.
+        """
+        min_bytes = max(1, self._dedup.get("min_bytes", 1))
+        files_by_size: Dict[int, List[FolderEntry]] = {}
+        for entry in self._iter_files_in_walk_order(scanned_folder):
+            entry.duplicate_of = None
+            if entry.is_included and not entry.is_binary and entry.change != "removed" and entry.size >= min_bytes:
+                files_by_size.setdefault(entry.size, []).append(entry)
+
+        candidates = [entry for same_size in files_by_size.values() if len(same_size) > 1 for entry in same_size]
+        if self._workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                hashes = dict(zip((entry.relative_path for entry in candidates), executor.map(self._content_hash, candidates)))
+        else:
+            hashes = {entry.relative_path: self._content_hash(entry) for entry in candidates}
+
+        for same_size in files_by_size.values():
+            if len(same_size) < 2:
+                continue
+            first_by_hash: Dict[str, FolderEntry] = {}
+            for entry in same_size:
+                content_hash = hashes[entry.relative_path]
+                if content_hash is None:
+                    continue
+                first = first_by_hash.setdefault(content_hash, entry)
+                if first is not entry:
+                    entry.duplicate_of = first.relative_path
+
+    def _drop_orphaned_duplicates(self, scanned_folder: FolderEntry) -> None:
+        """A reference is useless if the file it points to did not fit in the budget"""
+        over_budget = {entry.relative_path for entry in self._iter_files_in_walk_order(scanned_folder) if entry.is_over_budget}
+        for entry in self._iter_files_in_walk_order(scanned_folder):
+            if entry.duplicate_of in over_budget:
+                entry.is_over_budget = True
+
+    def _content_hash(self, entry: FolderEntry) -> Optional[str]:
+        """SHA-256 of a file's bytes, remembered per size and mtime. None if it cannot be read."""
+        identity = (entry.relative_path, entry.size, entry.mtime_ns)
+        content_hash = self._content_hashes.get(identity)
+        if content_hash is None:
+            import hashlib
+            file_hash = hashlib.sha256()
+            try:
+                with self._file_system.open(os.path.join(self.folder_to_serialize, entry.relative_path), 'rb') as f:
+                    for chunk in iter(lambda: f.read(self._HASH_CHUNK_BYTES), b""):
+                        file_hash.update(chunk)
+            except OSError:
+                # Left to the normal read, which reports the error
+                return None
+            content_hash = file_hash.hexdigest()
+            self._content_hashes[identity] = content_hash
+        return content_hash
+
+    @staticmethod
+    def _duplicate_text(entry: FolderEntry) -> str:
+        return f"[Duplicate of {entry.duplicate_of}]"
+
+    def _iter_files_in_walk_order(self, folder: FolderEntry) -> Iterator[FolderEntry]:
+        """Yield files top-down like os.walk: a folder's own files first, then each included subfolder"""
+        yield from folder.files
+        for subfolder in folder.folders:
+            if subfolder.is_included:
+                yield from self._iter_files_in_walk_order(subfolder)
+
+    def _get_hierarchy(self, folder: FolderEntry) -> str:
+        """Render the scanned tree. Lines are collected in a list, so the cost is linear in the output."""
+        needs_totals = self._hierarchy_needs_totals()
+        totals: Dict[int, Tuple[int, int]] = {}
+        if needs_totals:
+            self._collect_folder_totals(folder, totals)
+        lines: List[str] = []
+        self._append_hierarchy_lines(folder, "", 0, totals, lines)
+        return "".join(lines)
+
+    def _append_hierarchy_lines(self, folder: FolderEntry, prefix: str, depth: int, totals: Dict[int, Tuple[int, int]], lines: List[str]) -> None:
         file_skipped = "(NOT FEATURED)"
         file_binary = "(BINARY FILE)"
-        if not current_path:
-            current_path = self.folder_to_serialize
 
-        if not os.path.exists(current_path):
-            return f"The path {current_path} does not exist."
+        if not folder.is_included:
+            lines.append(f"{prefix}{folder.name}/ {file_skipped}\n")
+            return
+        if self._hierarchy_config.get("show_sizes", False):
+            file_count, byte_count = totals[id(folder)]
+            lines.append(f"{prefix}{folder.name}/ ({file_count:,} file{'s' if file_count != 1 else ''}, {self._format_size(byte_count)})\n")
+        else:
+            lines.append(f"{prefix}{folder.name}/\n")
+        prefix += "  "
+
+        # Below the depth limit, a folder's content is only summarized
+        max_depth = self._hierarchy_config.get("max_depth")
+        if max_depth is not None and depth >= max_depth:
+            if folder.folders or folder.files:
+                file_count, byte_count = totals[id(folder)]
+                lines.append(f"{prefix}… {self._hidden_entries_summary(len(folder.folders), file_count, byte_count, '')}\n")
+            return
 
-        hierarchy = ""
-        folder_name = os.path.basename(current_path)
-        if not self._should_process_folder(folder_name):
-            hierarchy += f"{prefix}{folder_name}/ {file_skipped}\n"
+        # Directories first, then files; past the cap the rest is summarized in one line
+        entries = folder.folders + folder.files
+        max_entries = self._hierarchy_config.get("max_entries_per_folder")
+        if max_entries is not None and len(entries) > max_entries:
+            entries, hidden_entries = entries[:max_entries], entries[max_entries:]
         else:
-            hierarchy += f"{prefix}{folder_name}/\n"
-            prefix += "  "
-
-            # Get all items and sort them
-            all_items = sorted(os.listdir(current_path))
-            dirs = [item for item in all_items if os.path.isdir(os.path.join(current_path, item))]
-            files = [item for item in all_items if os.path.isfile(os.path.join(current_path, item))]
-
-            # Sort directories and files according to show_first/show_last rules
-            sorted_dirs = self._sort_items(dirs, self._CONFIG_FOLDERS)
-            sorted_files = self._sort_items(files, self._CONFIG_FILES)
-
-            # Add directories first
-            for item in sorted_dirs:
-                item_path = os.path.join(current_path, item)
-                hierarchy += self._get_hierarchy(item_path, prefix)
-
-            # Then add files
-            for item in sorted_files:
-                file_extension = os.path.splitext(item)[-1].lower()
-                if not self._should_process_file(item):
-                    hierarchy += f"{prefix}{item} {file_skipped}\n"
-                elif file_extension in self.BINARY_FILE_EXTENSIONS:
-                    hierarchy += f"{prefix}{item} {file_binary}\n"
+            hidden_entries = []
+
+        for item in entries:
+            if item.is_dir:
+                self._append_hierarchy_lines(item, prefix, depth + 1, totals, lines)
+                continue
+            change = f" ({item.change.upper()})" if item.change is not None else ""
+            if not item.is_included:
+                lines.append(f"{prefix}{item.name} {file_skipped}\n")
+            elif item.is_binary:
+                lines.append(f"{prefix}{item.name} {file_binary}{change}\n")
+            else:
+                lines.append(f"{prefix}{item.name}{change}\n")
+
+        if hidden_entries:
+            folder_count = file_count = byte_count = 0
+            for item in hidden_entries:
+                if item.is_dir:
+                    folder_count += 1
+                    file_count += totals[id(item)][0]
+                    byte_count += totals[id(item)][1]
                 else:
-                    hierarchy += f"{prefix}{item}\n"
-
-        return hierarchy
-
-    def _should_process_folder(self, folder_name: str) -> bool:
-        # Check global blacklist first
-        if folder_name in self.GLOBAL_BLACKLISTED_FOLDERS:
-            return False
-
-        # Then check user-defined whitelist/blacklist
-        if self._whitelist[self._CONFIG_FOLDERS] and folder_name not in self._whitelist[self._CONFIG_FOLDERS]:
-            return False
-        return folder_name not in self._blacklist[self._CONFIG_FOLDERS]
+                    file_count += 1
+                    byte_count += item.size
+            lines.append(f"{prefix}… {self._hidden_entries_summary(folder_count, file_count, byte_count, 'more ')}\n")
+
+    def _hierarchy_needs_totals(self) -> bool:
+        """Whether the hierarchy shows file counts and sizes, which include the files filtered out"""
+        return any(self._hierarchy_config.get(key) for key in ("max_depth", "max_entries_per_folder", "show_sizes"))
+
+    def _collect_folder_totals(self, folder: FolderEntry, totals: Dict[int, Tuple[int, int]]) -> Tuple[int, int]:
+        """Number and size of the scanned files below each folder, keyed on id(folder)"""
+        file_count = len(folder.files)
+        byte_count = sum(item.size for item in folder.files)
+        for subfolder in folder.folders:
+            subfolder_files, subfolder_bytes = self._collect_folder_totals(subfolder, totals)
+            file_count += subfolder_files
+            byte_count += subfolder_bytes
+        totals[id(folder)] = (file_count, byte_count)
+        return file_count, byte_count
+
+    def _hidden_entries_summary(self, folder_count: int, file_count: int, byte_count: int, more: str) -> str:
+        summary = f"{folder_count:,} {more}folder{'s' if folder_count != 1 else ''}, " if folder_count else ""
+        return summary + f"{file_count:,} {more}file{'s' if file_count != 1 else ''} ({self._format_size(byte_count)})"
 
-    def _should_process_file(self, file_name: str) -> bool:
-        # Check file extension against global binary blacklist first
-        file_extension = os.path.splitext(file_name)[-1].lower()
-        if file_extension in self.BINARY_FILE_EXTENSIONS:
-            return False
-
-        # Then check user-defined extension rules
-        if self._whitelist[self._CONFIG_EXTENSIONS] and file_extension not in self._whitelist[self._CONFIG_EXTENSIONS]:
-            return False
-        if file_extension in self._blacklist[self._CONFIG_EXTENSIONS]:
-            return False
-
-        # Check specific file (e.g. hello_world.py)
-        file_name_without_extension = os.path.splitext(file_name)[0]
-        if self._whitelist[self._CONFIG_FILES] and file_name not in self._whitelist[self._CONFIG_FILES]:
-            # Try without extension (e.g. hello_world)
-            if self._whitelist[self._CONFIG_FILES] and file_name_without_extension not in self._whitelist[self._CONFIG_FILES]:
-                return False
-        if file_name in self._blacklist[self._CONFIG_FILES] or file_name_without_extension in self._blacklist[self._CONFIG_FILES]:
-            return False
-        return True
+    @staticmethod
+    def _format_size(byte_count: int) -> str:
+        size = float(byte_count)
+        for unit in ("B", "KB", "MB", "GB"):
+            if size < 1024 or unit == "GB":
+                break
+            size /= 1024
+        return f"{size:.0f} {unit}" if unit == "B" or size >= 10 else f"{size:.1f} {unit}"
+
+    def _get_filters(self) -> FolderFilters:
+        """Compile the global lists and the config's blacklist/whitelist on first use"""
+        if self._filters is None:
+            self._filters = FolderFilters(
+                folder_blacklist=FilterMatcher.compile(self.GLOBAL_BLACKLISTED_FOLDERS | self._blacklist[self._CONFIG_FOLDERS]),
+                folder_whitelist=FilterMatcher.compile(self._whitelist[self._CONFIG_FOLDERS]),
+                file_blacklist=FilterMatcher.compile(self._blacklist[self._CONFIG_FILES]),
+                file_whitelist=FilterMatcher.compile(self._whitelist[self._CONFIG_FILES]),
+                binary_extensions=self.BINARY_FILE_EXTENSIONS,
+                extension_whitelist=self._whitelist[self._CONFIG_EXTENSIONS],
+                extension_blacklist=self._blacklist[self._CONFIG_EXTENSIONS],
+            )
+        return self._filters
+
+    def _should_process_folder(self, folder_name: str, relative_path: Optional[str] = None) -> bool:
+        return self._get_filters().should_process_folder(folder_name, relative_path)
+
+    def _should_process_file(self, file_name: str, relative_path: Optional[str] = None) -> bool:
+        return self._get_filters().file_decision(file_name, relative_path)[0]
 
 
 #######################
@@ -430,10 +2078,46 @@ class FolderSerializerTesting:
         config_path = FolderSerializerTesting._load_testing_config()
         serializer = FolderSerializer.create_from_config(config_path)
         serializer.folder_to_serialize = FolderSerializerTesting._testing_folder_to_serialize()
+        # Git does not keep empty folders, so a fresh checkout lacks this one
+        os.makedirs(os.path.join(serializer.folder_to_serialize, FolderSerializerTesting._EMPTY_FOLDER), exist_ok=True)
         serializer.serialize_folder()
         output = FolderSerializerTesting._generate_path_to_test_output()
         serializer.write_output(output)
         FolderSerializerTesting._verify_test_output()
+        FolderSerializerTesting.feature_tests()
+
+    @staticmethod
+    def feature_tests() -> bool:
+        """Check optional features, each on its own temporary fixture tree. Returns True if all checks passed."""
+        checks = [
+            FolderSerializerTesting._test_streaming_equivalence,
+            FolderSerializerTesting._test_compressed_parts_manifest,
+            FolderSerializerTesting._test_stdout_mode,
+            FolderSerializerTesting._test_anchored_global_folders,
+            FolderSerializerTesting._test_cache_per_root,
+            FolderSerializerTesting._test_snapshot_diff,
+            FolderSerializerTesting._test_shared_scan_eviction,
+            FolderSerializerTesting._test_budget_priority,
+            FolderSerializerTesting._test_transforms_under_budget,
+            FolderSerializerTesting._test_dedup,
+            FolderSerializerTesting._test_async_output_equivalence,
+            FolderSerializerTesting._test_excluded_files_not_stated,
+            FolderSerializerTesting._test_watch_dedup_update,
+        ]
+        failed = 0
+        for check in checks:
+            name = check.__name__[len("_test_"):]
+            try:
+                failure = check()
+            except Exception as e:
+                failure = f"{type(e).__name__}: {str(e)}"
+            if failure is None:
+                print(f"Test passed! {name}")
+            else:
+                failed += 1
+                print(f"Test failed! {name}: {failure}")
+        print(f"{len(checks) - failed}/{len(checks)} feature tests passed\n")
+        return failed == 0
 
     ###########################
     ### PRIVATE CLASS STUFF ###
@@ -442,6 +2126,7 @@ class FolderSerializerTesting:
     # Folder paths for testing
     _FOLDER_USED_TO_TEST_PROGRAM = "folder_used_to_test_program"
     _FOLDER_TO_SERIALIZE_DURING_TEST = "folder_to_be_serialized"
+    _EMPTY_FOLDER = "empty_folder"
 
     # Files used for testing
     _TEST_INPUT_FILE = "test_configs.json"
@@ -500,6 +2185,10 @@ class FolderSerializerTesting:
             print(f"Test failed! Error reading expected output file: {str(e)}")
             return
 
+        # The expected output was recorded on Windows; file markers hold paths with the platform's separator
+        expected_output = re.sub(r"^(--- (?:Start|End) of File: .*) ---$", lambda match: match.group(0).replace("\\", os.sep),
+                                 expected_output, flags=re.MULTILINE)
+
         msg_output = f"{FolderSerializerTesting._TEST_OUTPUT_FILE} ({len(output)} characters)"
         msg_expected = f"{FolderSerializerTesting._EXPECTED_TEST_OUTPUT_FILE} ({len(expected_output)} characters)"
 
@@ -522,4 +2211,427 @@ class FolderSerializerTesting:
                     print(f"First difference at line {i+1}:")
                     print(f"  Got:      '{line_out}'")
                     print(f"  Expected: '{line_exp}'")
-                    break
\ No newline at end of file
+                    break
+
+    ### Feature tests ###
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _fixture_tree(files: Dict[str, str]) -> Iterator[str]:
+        """A temporary folder holding 'files' (relative path with '/' -> content), removed afterwards"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            for relative_path, content in files.items():
+                file_path = os.path.join(root, *relative_path.split("/"))
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(content)
+            yield root
+
+    @staticmethod
+    def _fixture_serializer(root: str, **config) -> FolderSerializer:
+        return FolderSerializer.create_from_dict({FolderSerializer._FOLDER_TO_SERIALIZE: root, **config})
+
+    @staticmethod
+    def _featured_files(output: str) -> List[str]:
+        """Relative paths of the file blocks in 'output', in output order"""
+        return re.findall(r"^--- Start of File: (.*) ---$", output, flags=re.MULTILINE)
+
+    @staticmethod
+    def _test_budget_priority() -> Optional[str]:
+        files = {"0_last.txt": "l" * 100, "a_big.py": "b" * 2500, "zz_first.txt": "f" * 100}
+        files.update({f"{name}.py": name * 100 for name in "bcde"})
+        priorities = {
+            FolderSerializer._SHOW_FIRST: {FolderSerializer._CONFIG_FILES: ["zz_first"], FolderSerializer._CONFIG_FOLDERS: []},
+            FolderSerializer._SHOW_LAST: {FolderSerializer._CONFIG_FILES: ["0_last"], FolderSerializer._CONFIG_FOLDERS: []},
+        }
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            # The big file does not fit, but every smaller file after it still does
+            budget = 2000
+            serializer = FolderSerializerTesting._fixture_serializer(root, limits={"max_total_chars": budget}, **priorities)
+            output = "".join(serializer.iter_serialized_folder())
+            if len(output) > budget:
+                return f"{len(output)} characters for a budget of {budget}"
+            expected_files = ["zz_first.txt", "b.py", "c.py", "d.py", "e.py", "0_last.txt"]
+            if FolderSerializerTesting._featured_files(output) != expected_files:
+                return f"featured {FolderSerializerTesting._featured_files(output)}, expected {expected_files}"
+
+            # One character short: the show_last file is the one dropped
+            serializer = FolderSerializerTesting._fixture_serializer(root, limits={"max_total_chars": len(output) - 1}, **priorities)
+            scanned_folder = serializer._scan_or_none()
+            tight_output = "".join(piece for _, piece in serializer._iter_keyed_pieces(scanned_folder))
+            if FolderSerializerTesting._featured_files(tight_output) != expected_files[:-1]:
+                return f"with a tight budget featured {FolderSerializerTesting._featured_files(tight_output)}"
+
+            # Entries reused across plans, as in watch mode, must not keep an earlier plan's decisions
+            serializer._limits["max_total_chars"] = budget
+            replanned_output = "".join(piece for _, piece in serializer._iter_keyed_pieces(scanned_folder))
+            if replanned_output != output:
+                return "replanning the same scan with a larger budget differs from a fresh run"
+        return None
+
+    @staticmethod
+    def _test_transforms_under_budget() -> Optional[str]:
+        files = {
+            "a.py": 'def f():\n    """Usage:\n    # not a comment\n    """\n    # a comment\n    return 1\n',
+            "b.py": "x = 1\nDEBUG\ny = 2\n" + "log('DEBUG: a long diagnostic line')\n" * 10 + "z = 3\n",
+        }
+        transforms = {".py": [{"name": "strip_comments"}, {"name": "elide_lines", "pattern": "DEBUG", "marker": True}]}
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            full_output = "".join(FolderSerializerTesting._fixture_serializer(root).iter_serialized_folder())
+            # Planned on file sizes, so a budget that fits the untransformed files must fit the transformed ones
+            budget = len(full_output)
+            serializer = FolderSerializerTesting._fixture_serializer(root, limits={"max_total_chars": budget}, transforms=transforms)
+            output = "".join(serializer.iter_serialized_folder())
+            if len(output) > budget:
+                return f"{len(output)} characters for a budget of {budget}"
+            if FolderSerializerTesting._featured_files(output) != ["a.py", "b.py"]:
+                return f"featured {FolderSerializerTesting._featured_files(output)}"
+            if "# not a comment" not in output or "# a comment" in output:
+                return "strip_comments must keep '#' lines inside docstrings and drop the others"
+            if "x = 1\nDEBUG\ny = 2\n[10 lines elided]\nz = 3\n" not in output:
+                return "elide_lines must keep runs shorter than its marker and replace longer ones"
+            if any(saved_bytes < 0 for saved_bytes in serializer._transform_savings.values()):
+                return f"negative savings {serializer._transform_savings}"
+        return None
+
+    @staticmethod
+    def _test_async_output_equivalence() -> Optional[str]:
+        class CountingFileSystem(LocalFileSystem):
+            def __init__(self):
+                self.listed_folders = []
+                self.opened_files = []
+
+            def scandir(self, folder_path: str) -> Dict[str, os.DirEntry]:
+                self.listed_folders.append(folder_path)
+                return super().scandir(folder_path)
+
+            def open(self, file_path: str, mode: str = 'r', **kwargs):
+                self.opened_files.append(file_path)
+                return super().open(file_path, mode, **kwargs)
+
+        files = {".gitignore": "ignored/\n*.log\n", "debug.log": "log\n", "main.py": "print('main')\n"}
+        files.update({f"src/module_{index}.py": f"value = {index}\n" * (index + 1) for index in range(20)})
+        files.update({f"ignored/deep_{index}/data.txt": "data\n" for index in range(10)})
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            outputs = {}
+            listed_folders = {}
+            for mode, async_io in [("sequential", False), ("async", True)]:
+                serializer = FolderSerializerTesting._fixture_serializer(
+                    root, gitignore={"enabled": True}, async_io={"enabled": async_io, "concurrency": 4})
+                serializer._file_system = CountingFileSystem()
+                outputs[mode] = "".join(serializer.iter_serialized_folder())
+                listed_folders[mode] = sorted(serializer._file_system.listed_folders)
+            if outputs["async"] != outputs["sequential"]:
+                return "async output differs from the sequential output"
+            if listed_folders["async"] != listed_folders["sequential"]:
+                return f"async run listed {len(listed_folders['async'])} folders, sequential run {len(listed_folders['sequential'])}"
+            if "ignored" in FolderSerializerTesting._featured_files(outputs["async"]) or "debug.log" in outputs["async"]:
+                return "gitignored files were serialized"
+
+            # Files dropped by the budget or by dedup are not read, early reads included
+            for extra_config in ({"limits": {"max_total_chars": 400}}, {"dedup": {"enabled": True}}):
+                opened_files = {}
+                for mode, async_io in [("sequential", False), ("async", True)]:
+                    serializer = FolderSerializerTesting._fixture_serializer(root, async_io={"enabled": async_io, "concurrency": 4}, **extra_config)
+                    serializer._file_system = CountingFileSystem()
+                    outputs[mode] = "".join(serializer.iter_serialized_folder())
+                    opened_files[mode] = sorted(serializer._file_system.opened_files)
+                if outputs["async"] != outputs["sequential"] or opened_files["async"] != opened_files["sequential"]:
+                    return f"with {extra_config} the async run opened {len(opened_files['async'])} files, the sequential run {len(opened_files['sequential'])}"
+        return None
+
+    @staticmethod
+    def _test_excluded_files_not_stated() -> Optional[str]:
+        class StatCountingFileSystem(LocalFileSystem):
+            def __init__(self):
+                self.stated_files = []
+
+            def stat(self, dir_entry: os.DirEntry) -> os.stat_result:
+                self.stated_files.append(dir_entry.name)
+                return super().stat(dir_entry)
+
+        files = {"main.py": "print('main')\n", "debug.log": "log\n" * 100}
+        blacklist = {FolderSerializer._CONFIG_EXTENSIONS: [".log"]}
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            for async_io in (False, True):
+                # Only shown sizes count the excluded files, so only then are they stat'ed
+                for show_sizes, expected_stated in [(False, ["main.py"]), (True, ["debug.log", "main.py"])]:
+                    serializer = FolderSerializerTesting._fixture_serializer(
+                        root, blacklist=blacklist, hierarchy={"show_sizes": show_sizes}, async_io={"enabled": async_io})
+                    serializer._file_system = StatCountingFileSystem()
+                    output = "".join(serializer.iter_serialized_folder())
+                    if sorted(serializer._file_system.stated_files) != expected_stated:
+                        return f"stat'ed {sorted(serializer._file_system.stated_files)} with show_sizes={show_sizes}, async_io={async_io}"
+                    if FolderSerializerTesting._featured_files(output) != ["main.py"]:
+                        return f"featured {FolderSerializerTesting._featured_files(output)}"
+                    if show_sizes and "(2 files, 414 B)" not in output:
+                        return "folder sizes must still count the excluded files"
+        return None
+
+    @staticmethod
+    def _test_watch_dedup_update() -> Optional[str]:
+        from folder_watcher import FolderWatcher, MemoryContentCache
+        with FolderSerializerTesting._fixture_tree({"a.txt": "same\n", "b.txt": "same\n"}) as root, \
+                FolderSerializerTesting._fixture_tree({}) as output_folder:
+            output_path = os.path.join(output_folder, "watched.txt")
+            serializer = FolderSerializerTesting._fixture_serializer(root, dedup={"enabled": True})
+            serializer._cache = MemoryContentCache()
+            watcher = FolderWatcher(serializer, output_path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                watcher._update(serializer._scan_folder(), changed_files=None, first_event_time=time.perf_counter())
+                # b.txt is untouched, but stops being a duplicate of a.txt
+                with open(os.path.join(root, "a.txt"), 'w', encoding='utf-8') as f:
+                    f.write("changed\n")
+                watcher._update(serializer._scan_folder(), changed_files={"a.txt"}, first_event_time=time.perf_counter())
+            with open(output_path, 'rb') as f:
+                watched_output = f.read()
+            fresh_output = "".join(FolderSerializerTesting._fixture_serializer(root, dedup={"enabled": True}).iter_serialized_folder())
+            if watched_output != fresh_output.replace("\n", os.linesep).encode('utf-8'):
+                return "the watched output differs from a fresh run after a duplicate changed"
+        return None
+
+    @staticmethod
+    def _test_streaming_equivalence() -> Optional[str]:
+        files = {
+            "small.py": "print('hello')\n",
+            "unicode.txt": "Grüße, 世界 ✓\n" * 20,
+            "windows.txt": "line one\r\nline two\r\n",
+            "large.txt": "0123456789abcdef\n" * 200,
+            "nested/empty.txt": "",
+        }
+        with FolderSerializerTesting._fixture_tree(files) as root, FolderSerializerTesting._fixture_tree({}) as output_folder:
+            expected_output = None
+            for workers in (1, 4):
+                serializer = FolderSerializerTesting._fixture_serializer(root, workers=workers)
+                # Low enough that the large file takes the raw copy path
+                serializer._mmap_threshold_bytes = 1024
+                serializer.serialize_folder()
+                if expected_output is None:
+                    expected_output = serializer._folder_content_as_str
+                elif serializer._folder_content_as_str != expected_output:
+                    return f"serialize_folder with {workers} workers differs"
+
+                stream = io.StringIO()
+                serializer.write_output_stream(stream)
+                if stream.getvalue() != expected_output:
+                    return f"write_output_stream with {workers} workers differs from serialize_folder"
+
+                binary_stream = io.BytesIO()
+                serializer.write_output_binary(binary_stream)
+                if binary_stream.getvalue().decode('utf-8').replace(os.linesep, "\n") != expected_output:
+                    return f"write_output_binary with {workers} workers differs from serialize_folder"
+
+                output_path = os.path.join(output_folder, f"stream_{workers}.txt")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    serializer.stream_output(output_path)
+                with open(output_path, 'r', encoding='utf-8') as f:
+                    if f.read() != expected_output:
+                        return f"stream_output with {workers} workers differs from serialize_folder"
+        return None
+
+    @staticmethod
+    def _test_compressed_parts_manifest() -> Optional[str]:
+        import gzip
+        from folder_dump_index import DumpIndex
+        files = {f"module_{index}.py": f"value = {index}\n" * (index + 5) for index in range(8)}
+        files["unicode.txt"] = "Grüße, 世界\n" * 10
+        with FolderSerializerTesting._fixture_tree(files) as root, FolderSerializerTesting._fixture_tree({}) as output_folder:
+            expected_output = "".join(FolderSerializerTesting._fixture_serializer(root).iter_serialized_folder())
+            serializer = FolderSerializerTesting._fixture_serializer(root, output={"compression": "gzip", "chunk_chars": 400, "manifest": True})
+            output_path = os.path.join(output_folder, "dump.txt")
+            with contextlib.redirect_stdout(io.StringIO()):
+                serializer.stream_output(output_path)
+
+            index = DumpIndex.load(output_path + FolderSerializer._MANIFEST_SUFFIX)
+            if len(index.chunks) < 2:
+                return f"expected several parts, got {len(index.chunks)}"
+            parts = []
+            for chunk in index.chunks:
+                with gzip.open(os.path.join(output_folder, chunk["path"]), 'rb') as f:
+                    parts.append(f.read())
+            if b"".join(parts).decode('utf-8').replace(os.linesep, "\n") != expected_output:
+                return "the decompressed parts differ from the uncompressed output"
+            for relative_path, content in files.items():
+                if index.extract(relative_path) != content:
+                    return f"the manifest does not lead back to the content of {relative_path}"
+        return None
+
+    @staticmethod
+    def _test_dedup() -> Optional[str]:
+        shared = "def shared():\n    return 42\n"
+        files = {
+            "a.py": shared,
+            "copies/b.py": shared,
+            "copies/c.py": shared.replace("42", "43"),
+            "tiny_1.txt": "x",
+            "tiny_2.txt": "x",
+        }
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            serializer = FolderSerializerTesting._fixture_serializer(root, dedup={"enabled": True, "min_bytes": 2}, workers=4)
+            output = "".join(serializer.iter_serialized_folder())
+            b_path = os.path.join("copies", "b.py")
+            c_path = os.path.join("copies", "c.py")
+            if FolderSerializer._format_file_block(b_path, "[Duplicate of a.py]") not in output:
+                return "b.py is not referenced as a duplicate of a.py"
+            if FolderSerializer._format_file_block(c_path, shared.replace("42", "43")) not in output:
+                return "c.py has the same size as a.py but different content, so it must be shown in full"
+            if FolderSerializer._format_file_block("tiny_2.txt", "x") not in output:
+                return "files below 'min_bytes' must be shown in full"
+            if serializer._duplicate_files != 1:
+                return f"counted {serializer._duplicate_files} duplicates, expected 1"
+        return None
+
+    @staticmethod
+    def _test_stdout_mode() -> Optional[str]:
+        files = {"good.py": "print('good')\n", "broken.py": "print('broken')\n"}
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            full_output = "".join(FolderSerializerTesting._fixture_serializer(root).iter_serialized_folder())
+            expected_output = full_output.replace(FolderSerializer._format_file_block("broken.py", "print('broken')\n"), "")
+
+            serializer = FolderSerializerTesting._fixture_serializer(root)
+            read_file = serializer._read_file
+            serializer._read_file = lambda entry, raw_blocks=False: ("", OSError("unreadable")) if entry.name == "broken.py" else read_file(entry, raw_blocks)
+            stdout, stderr = FolderSerializerTesting._capture_output(lambda: (serializer.stream_output("-"), serializer.print_summary()))
+            if stdout != expected_output:
+                return "stdout holds more than the serialized output"
+            if "Error reading file" not in stderr or "Files Read: 1" not in stderr:
+                return "read errors and the summary must go to stderr"
+
+            missing_root = os.path.join(root, "missing")
+            stdout, stderr = FolderSerializerTesting._capture_output(lambda: FolderSerializer.main_roots([root, missing_root]))
+            if stdout != full_output + "".join(FolderSerializerTesting._fixture_serializer(missing_root).iter_serialized_folder()):
+                return "several roots must be written to stdout one after another, a missing one noted once"
+            if "does not exist" not in stderr:
+                return "a missing root must also be reported on stderr"
+        return None
+
+    @staticmethod
+    def _capture_output(action: Callable[[], object]) -> Tuple[str, str]:
+        """Run 'action' and return what it wrote to stdout (including stdout.buffer) and to stderr"""
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', newline='')
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            action()
+        stdout.flush()
+        return stdout.buffer.getvalue().decode('utf-8').replace(os.linesep, "\n"), stderr.getvalue()
+
+    @staticmethod
+    def _test_anchored_global_folders() -> Optional[str]:
+        files = {"ios/App.swift": "app\n", "ios/Pods/Lib.swift": "pod\n", "mobile/ios/Pods/Notes.swift": "kept\n"}
+        with FolderSerializerTesting._fixture_tree(files) as root:
+            serializer = FolderSerializerTesting._fixture_serializer(root)
+            output = "".join(serializer.iter_serialized_folder())
+            # 'ios/Pods' in the global list contains a '/', so it only matches at the root
+            expected_files = [os.path.join("ios", "App.swift"), os.path.join("mobile", "ios", "Pods", "Notes.swift")]
+            if FolderSerializerTesting._featured_files(output) != expected_files:
+                return f"featured {FolderSerializerTesting._featured_files(output)}, expected {expected_files}"
+            # 'docs/_build' is anchored the same way, although the global name '_build' still excludes it at any depth
+            folder_blacklist = serializer._get_filters().folder_blacklist
+            for relative_path, expected in [("ios/Pods", True), ("mobile/ios/Pods", False), ("docs/_build", True), ("src/docs/_build", False)]:
+                if folder_blacklist.matches_path(relative_path, is_dir=True) != expected:
+                    return f"the global path rules {'missed' if expected else 'matched'} {relative_path}"
+        return None
+
+    @staticmethod
+    def _test_cache_per_root() -> Optional[str]:
+        with FolderSerializerTesting._fixture_tree({"x.py": "secret_A\n"}) as first_root, \
+                FolderSerializerTesting._fixture_tree({"x.py": "public_B\n"}) as second_root, \
+                FolderSerializerTesting._fixture_tree({}) as cache_folder:
+            # Same relative path, size and mtime: only the root tells the files apart
+            mtime_ns = os.stat(os.path.join(first_root, "x.py")).st_mtime_ns
+            os.utime(os.path.join(second_root, "x.py"), ns=(mtime_ns, mtime_ns))
+            if FolderSerializer._cache_folder_for("out/x.txt", "c", first_root) == FolderSerializer._cache_folder_for("out/x.txt", "c", second_root):
+                return "both roots got the same cache folder"
+
+            # Even a shared cache folder, as after editing 'folder_to_serialize', must not serve the other root
+            for root, expected_content in [(first_root, "secret_A"), (second_root, "public_B"), (first_root, "secret_A")]:
+                serializer = FolderSerializerTesting._fixture_serializer(root)
+                serializer.enable_cache(cache_folder)
+                output = "".join(serializer.iter_serialized_folder())
+                serializer._cache.save()
+                if expected_content not in output:
+                    return f"the cache served another root's content for {root}"
+        return None
+
+    @staticmethod
+    def _test_snapshot_diff() -> Optional[str]:
+        class OpenCountingFileSystem(LocalFileSystem):
+            def __init__(self):
+                self.opened_files = []
+
+            def open(self, file_path: str, mode: str = 'r', **kwargs):
+                self.opened_files.append(os.path.basename(file_path))
+                return super().open(file_path, mode, **kwargs)
+
+        files = {"untouched.py": "same = 0\n", "touched.py": "same = 1\n", "modified.py": "value = 1\n", "old/gone.py": "gone = True\n"}
+        with FolderSerializerTesting._fixture_tree(files) as root, FolderSerializerTesting._fixture_tree({}) as output_folder:
+            output_path = os.path.join(output_folder, "dump.txt")
+            with contextlib.redirect_stdout(io.StringIO()):
+                FolderSerializerTesting._fixture_serializer(root, output={"manifest": True}).stream_output(output_path)
+
+            # Same size with a new mtime, so both need their content hash to tell them apart
+            for name, content in [("touched.py", "same = 1\n"), ("modified.py", "value = 2\n")]:
+                file_path = os.path.join(root, name)
+                mtime_ns = os.stat(file_path).st_mtime_ns
+                with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(content)
+                os.utime(file_path, ns=(mtime_ns + 5 * 10**9, mtime_ns + 5 * 10**9))
+            with open(os.path.join(root, "added.py"), 'w', encoding='utf-8') as f:
+                f.write("added = True\n")
+            os.remove(os.path.join(root, "old", "gone.py"))
+            os.rmdir(os.path.join(root, "old"))
+
+            serializer = FolderSerializerTesting._fixture_serializer(root)
+            serializer.enable_snapshot_diff(output_path + FolderSerializer._MANIFEST_SUFFIX)
+            serializer._file_system = OpenCountingFileSystem()
+            output = "".join(serializer.iter_serialized_folder())
+            if sorted(FolderSerializerTesting._featured_files(output)) != sorted(["added.py", "modified.py", os.path.join("old", "gone.py")]):
+                return f"featured {FolderSerializerTesting._featured_files(output)}"
+            hierarchy = output[:output.index("--- Start of File:")]
+            for line in ("added.py (ADDED)", "modified.py (MODIFIED)", "old/", "gone.py (REMOVED)"):
+                if line not in hierarchy:
+                    return f"'{line}' missing from the delta hierarchy"
+            if "touched.py" in hierarchy:
+                return "unchanged files must not appear in the delta hierarchy"
+            if "value = 2" not in output or FolderSerializer._REMOVED_FILE_TEXT not in output:
+                return "the modified file's new content or the removed file's block is missing"
+            if serializer._snapshot_changes != {"added": 1, "modified": 1, "removed": 1, "unchanged": 2}:
+                return f"counted {serializer._snapshot_changes}"
+            # Size and mtime clear the untouched file; the hashed modified file is not read a second time
+            opened_files = sorted(serializer._file_system.opened_files)
+            if opened_files != ["added.py", "modified.py", "touched.py"]:
+                return f"opened {opened_files}"
+        return None
+
+    @staticmethod
+    def _test_shared_scan_eviction() -> Optional[str]:
+        from folder_serializer_batch import SharedScan
+        files = {"both.py": "shared = True\n", "only_first.py": "first = True\n", "notes.txt": "notes\n"}
+        configs = [
+            {FolderSerializer._WHITELIST: {FolderSerializer._CONFIG_EXTENSIONS: [".py"]}},
+            {FolderSerializer._BLACKLIST: {FolderSerializer._CONFIG_FILES: ["only_first.py"]}},
+        ]
+        with FolderSerializerTesting._fixture_tree(files) as root, FolderSerializerTesting._fixture_tree({}) as output_folder:
+            # Under the cap, a content stays until its last reader; over it, files are simply read again
+            for max_content_chars, expected_kept, expected_reused in [(SharedScan.max_content_chars, [["both.py"], []], 1), (0, [[], []], 0)]:
+                shared_scan = SharedScan(max_content_chars=max_content_chars)
+                serializers = [FolderSerializerTesting._fixture_serializer(root, **config) for config in configs]
+                for serializer in serializers:
+                    serializer.use_shared_scan(shared_scan)
+                    serializer._expect_shared_reads()
+                kept = []
+                for index, (serializer, config) in enumerate(zip(serializers, configs)):
+                    output_path = os.path.join(output_folder, f"shared_{index}.txt")
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        serializer.stream_output(output_path)
+                    shared_scan.release_reads(serializer._shared_reads)
+                    kept.append(sorted(shared_scan._contents))
+                    with open(output_path, 'r', encoding='utf-8') as f:
+                        if f.read() != "".join(FolderSerializerTesting._fixture_serializer(root, **config).iter_serialized_folder()):
+                            return f"config {index} differs from a run without a shared scan"
+                if kept != expected_kept:
+                    return f"contents kept after each config: {kept}, expected {expected_kept}"
+                if shared_scan.contents_reused != expected_reused or shared_scan._pending_reads or shared_scan._content_chars:
+                    return f"{shared_scan.contents_reused} contents reused, {len(shared_scan._pending_reads)} reads still pending"
+        return None
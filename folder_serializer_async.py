@@ -0,0 +1,215 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from dataclasses import dataclass, field
+
+from folder_serializer import FolderSerializer, FolderEntry, FilterMatcher, LocalFileSystem, RawFileBlock
+
+
+@dataclass
+class LatencyFileSystem(LocalFileSystem):
+    """Local stand-in for a network mount: every listing, stat and open first sleeps like a remote round trip.
+
+    Sleeping releases the GIL just like a blocking network call, so benchmarks on a local tree show
+    how much of the latency a pipeline manages to overlap.
+    """
+    list_latency: float = 0.02
+    stat_latency: float = 0.005
+    open_latency: float = 0.02
+    # Each delay is scaled by a random factor between 1 - jitter and 1 + jitter
+    jitter: float = 0.0
+    seed: int = 0
+
+    _rng: Optional[random.Random] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+
+    def scandir(self, folder_path: str) -> Dict[str, os.DirEntry]:
+        self._sleep(self.list_latency)
+        return super().scandir(folder_path)
+
+    def stat(self, dir_entry: os.DirEntry) -> os.stat_result:
+        self._sleep(self.stat_latency)
+        return super().stat(dir_entry)
+
+    def open(self, file_path: str, mode: str = 'r', **kwargs):
+        self._sleep(self.open_latency)
+        return super().open(file_path, mode, **kwargs)
+
+    def _sleep(self, latency: float) -> None:
+        if self.jitter:
+            with self._lock:
+                latency *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+
+@dataclass
+class AsyncPipeline:
+    """Overlaps the listings, stats and reads of a FolderSerializer run on an asyncio event loop.
+
+    The blocking calls run on a thread pool; a semaphore keeps at most 'concurrency' of them in flight.
+    Prefetching only fills the serializer's listing and stat caches, so the scan itself, and with it
+    every filter decision and the output order, stays exactly that of a sequential run.
+
+    Reads of the first small files found start while the rest of the tree is still being listed, on a
+    pool of their own, and iter_file_contents() picks them up. Large files are left to it, since
+    they may be copied raw instead of read.
+    """
+    serializer: FolderSerializer
+    concurrency: int = FolderSerializer._DEFAULT_ASYNC_CONCURRENCY
+
+    _read_executor: Optional[ThreadPoolExecutor] = None
+    # Reads started during the prefetch, by relative path, with the entry they were started for
+    _early_reads: Dict[str, Tuple[FolderEntry, Future]] = field(default_factory=dict)
+
+    def prefetch_tree(self) -> None:
+        """List every folder the scan will enter and stat every file in it, as concurrently as allowed"""
+        asyncio.run(self._prefetch_tree())
+
+    def close(self) -> None:
+        """Drop reads that were started early but never picked up"""
+        for _, future in self._early_reads.values():
+            future.cancel()
+        self._early_reads = {}
+        if self._read_executor is not None:
+            self._read_executor.shutdown(wait=True)
+            self._read_executor = None
+
+    def iter_file_contents(self, entries: Iterator[FolderEntry], raw_blocks: bool = False) -> Iterator[Tuple[FolderEntry, Union[str, RawFileBlock], Optional[Exception]]]:
+        """Yield (entry, content, error) in the order of 'entries' while later files are read in the background"""
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def read(entry: FolderEntry) -> Tuple[Union[str, RawFileBlock], Optional[Exception]]:
+            async with semaphore:
+                return await loop.run_in_executor(executor, self.serializer._read_entry, entry, raw_blocks)
+
+        # Reads are started in output order and at most a fixed number of files ahead of the writer
+        max_in_flight = self.concurrency * FolderSerializer._READ_AHEAD_PER_WORKER
+        in_flight = deque()
+        try:
+            for entry in entries:
+                if not self.serializer._needs_read(entry):
+                    task = None
+                elif self._has_early_read(entry):
+                    task = asyncio.wrap_future(self._early_reads.pop(entry.relative_path)[1], loop=loop)
+                else:
+                    task = loop.create_task(read(entry))
+                in_flight.append((entry, task))
+                while len(in_flight) >= max_in_flight:
+                    yield self._resolve(loop, *in_flight.popleft())
+            while in_flight:
+                yield self._resolve(loop, *in_flight.popleft())
+        finally:
+            # Only left over when the consumer stopped early
+            abandoned = [task for _, task in in_flight if task is not None]
+            for task in abandoned:
+                task.cancel()
+            if abandoned:
+                loop.run_until_complete(asyncio.gather(*abandoned, return_exceptions=True))
+            executor.shutdown(wait=True)
+            loop.close()
+            self.close()
+
+    def _has_early_read(self, entry: FolderEntry) -> bool:
+        early_read = self._early_reads.get(entry.relative_path)
+        return early_read is not None and (early_read[0].size, early_read[0].mtime_ns) == (entry.size, entry.mtime_ns)
+
+    @staticmethod
+    def _resolve(loop: asyncio.AbstractEventLoop, entry: FolderEntry, task: Optional[asyncio.Task]) -> Tuple[FolderEntry, Union[str, RawFileBlock], Optional[Exception]]:
+        if task is None:
+            return entry, "", None
+        # Runs the loop until this read is done; reads started after it keep making progress meanwhile
+        return (entry, *loop.run_until_complete(task))
+
+    async def _prefetch_tree(self) -> None:
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        serializer = self.serializer
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if serializer._gitignore.get("enabled", False) and serializer._gitignore.get("use_git_index", False):
+                serializer._git_index = await loop.run_in_executor(executor, serializer._load_git_index)
+            await self._prefetch_folder("", serializer.folder_to_serialize, [], loop, executor, semaphore)
+
+    async def _prefetch_folder(self, relative_path: str, folder_path: str, ignore_rules: List[Tuple[str, FilterMatcher]],
+                               loop: asyncio.AbstractEventLoop, executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore) -> None:
+        serializer = self.serializer
+        async with semaphore:
+            try:
+                listing = await loop.run_in_executor(executor, serializer._file_system.scandir, folder_path)
+            except OSError as e:
+                # The scan reports the error when it gets to this folder
+                serializer._prefetched_listings[relative_path] = e
+                return
+            use_gitignore = serializer._gitignore.get("enabled", False)
+            if use_gitignore:
+                ignore_rules = ignore_rules + await loop.run_in_executor(executor, serializer._load_ignore_rules, relative_path, listing)
+        serializer._prefetched_listings[relative_path] = listing
+
+        # Folders the scan would not enter, by name filters or ignore rules, are not listed
+        filters = serializer._get_filters()
+        needs_totals = serializer._hierarchy_needs_totals()
+        pending = []
+        for name, dir_entry in listing.items():
+            child_path = os.path.join(relative_path, name)
+            if child_path in serializer._ignored_relative_paths:
+                continue
+            try:
+                is_dir = dir_entry.is_dir()
+                is_file = not is_dir and dir_entry.is_file()
+            except OSError:
+                continue
+            if use_gitignore and serializer._is_gitignored(child_path, name, is_dir, ignore_rules):
+                continue
+            if is_dir:
+                if not dir_entry.is_symlink() and filters.should_process_folder(name, child_path):
+                    pending.append(self._prefetch_folder(child_path, dir_entry.path, ignore_rules, loop, executor, semaphore))
+            elif is_file:
+                is_included, is_binary = filters.file_decision(name, child_path)
+                # Like the scan, excluded files are only stat'ed for the hierarchy totals
+                if is_included or needs_totals:
+                    pending.append(self._prefetch_file(dir_entry, child_path, is_included and not is_binary, loop, executor, semaphore))
+        await asyncio.gather(*pending)
+
+    async def _prefetch_file(self, dir_entry: os.DirEntry, relative_path: str, is_text_candidate: bool, loop: asyncio.AbstractEventLoop,
+                             executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore) -> None:
+        serializer = self.serializer
+        async with semaphore:
+            try:
+                stat_result = await loop.run_in_executor(executor, serializer._file_system.stat, dir_entry)
+            except OSError:
+                # Left to the scan, which records the file without size
+                return
+        serializer._prefetched_stats[dir_entry.path] = stat_result
+        if not is_text_candidate:
+            return
+        if serializer._binary_sniffing.get("enabled", False):
+            # Sniffing results are remembered per file identity, so the scan finds this one without opening the file
+            async with semaphore:
+                if await loop.run_in_executor(executor, serializer._sniff_is_binary, dir_entry.path, stat_result):
+                    return
+        self._start_early_read(dir_entry.name, relative_path, stat_result)
+
+    def _start_early_read(self, name: str, relative_path: str, stat_result: os.stat_result) -> None:
+        serializer = self.serializer
+        # Files at or above the threshold may be copied raw, which depends on how the output is written.
+        # Snapshot diffs read files themselves to compare them, so reading them here would only duplicate that.
+        # A budget or dedup may drop a file's content, and that is only decided once the scan is complete.
+        if (stat_result.st_size >= serializer._mmap_threshold_bytes or serializer._previous_snapshot is not None
+                or serializer._max_total_chars() is not None or serializer._dedup.get("enabled", False)
+                or len(self._early_reads) >= self.concurrency * FolderSerializer._READ_AHEAD_PER_WORKER):
+            return
+        if self._read_executor is None:
+            self._read_executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        entry = FolderEntry(name=name, relative_path=relative_path, is_dir=False, size=stat_result.st_size,
+                            mtime_ns=stat_result.st_mtime_ns, is_included=True)
+        self._early_reads[relative_path] = (entry, self._read_executor.submit(serializer._read_entry, entry))
@@ -0,0 +1,96 @@
+import os
+import threading
+from typing import Dict, Iterable, Tuple, Union
+from dataclasses import dataclass, field
+
+from folder_serializer import FolderEntry
+
+
+@dataclass
+class SharedScan:
+    """Folder listings and decoded file contents shared by every serializer of one root in a batch.
+
+    Keys are paths relative to the root, so configs may spell the root differently. Sniffing results
+    are keyed on file identity and can be shared as they are.
+
+    A content is only kept while a later config of the group still expects to read it (see expect_reads),
+    and only while all kept contents stay under 'max_content_chars'; past that, files are read again.
+    """
+    max_content_chars: int = 64 * 1024 * 1024
+
+    listings_reused: int = 0
+    contents_reused: int = 0
+    sniff_results: Dict[Tuple, bool] = field(default_factory=dict)
+
+    _listings: Dict[str, Union[Dict[str, os.DirEntry], OSError]] = field(default_factory=dict)
+    _contents: Dict[str, Tuple[int, int, str]] = field(default_factory=dict)
+    _content_chars: int = 0
+    # Number of configs that may still read each file
+    _pending_reads: Dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def list_folder(self, relative_path: str, folder_path: str) -> Dict[str, os.DirEntry]:
+        """The listing of one folder by name. DirEntry caches its stat, so each file is also stat'ed only once."""
+        with self._lock:
+            listing = self._listings.get(relative_path)
+            if listing is not None:
+                self.listings_reused += 1
+        if listing is None:
+            try:
+                with os.scandir(folder_path) as it:
+                    listing = {dir_entry.name: dir_entry for dir_entry in it}
+            except OSError as e:
+                listing = e
+            with self._lock:
+                self._listings[relative_path] = listing
+        if isinstance(listing, OSError):
+            raise listing
+        # Callers remove entries from their copy
+        return dict(listing)
+
+    def expect_reads(self, relative_paths: Iterable[str]) -> None:
+        """Announce the files one config may read. Every config of the group announces before the first one reads."""
+        with self._lock:
+            for relative_path in relative_paths:
+                self._pending_reads[relative_path] = self._pending_reads.get(relative_path, 0) + 1
+
+    def release_reads(self, relative_paths: Iterable[str]) -> None:
+        """Files a finished config announced but never read (cache hits, budget, ...) no longer wait for it"""
+        with self._lock:
+            for relative_path in relative_paths:
+                self._release(relative_path)
+
+    def read_text(self, entry: FolderEntry, file_path: str) -> str:
+        """Read a whole file as text once; later serializers get the same content while size and mtime match.
+
+        Counts as the read announced for this file by the calling config.
+        """
+        with self._lock:
+            cached = self._contents.get(entry.relative_path)
+            if cached is not None and cached[:2] == (entry.size, entry.mtime_ns):
+                self.contents_reused += 1
+                self._release(entry.relative_path)
+                return cached[2]
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+        with self._lock:
+            self._drop_content(entry.relative_path)
+            if self._pending_reads.get(entry.relative_path, 0) > 1 and self._content_chars + len(content) <= self.max_content_chars:
+                self._contents[entry.relative_path] = (entry.size, entry.mtime_ns, content)
+                self._content_chars += len(content)
+            self._release(entry.relative_path)
+        return content
+
+    def _release(self, relative_path: str) -> None:
+        """Count one expected read as done, dropping the content after the last one. The lock must be held."""
+        remaining = self._pending_reads.get(relative_path, 0) - 1
+        if remaining > 0:
+            self._pending_reads[relative_path] = remaining
+        else:
+            self._pending_reads.pop(relative_path, None)
+            self._drop_content(relative_path)
+
+    def _drop_content(self, relative_path: str) -> None:
+        dropped = self._contents.pop(relative_path, None)
+        if dropped is not None:
+            self._content_chars -= len(dropped[2])
@@ -0,0 +1,358 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, asdict
+
+from folder_serializer import FolderSerializer, FolderEntry
+
+
+@dataclass
+class SyntheticTreeSpec:
+    """Shape of a generated folder tree. The same spec and seed always produce the same tree."""
+    depth: int = 3
+    fan_out: int = 4
+    files_per_folder: int = 25
+    median_file_bytes: int = 4096
+    file_size_sigma: float = 1.2
+    max_file_bytes: int = 2 * 1024 * 1024
+    binary_ratio: float = 0.1
+    blacklisted_subtree_ratio: float = 0.1
+    seed: int = 0
+
+    def generate(self, root: str) -> Dict[str, int]:
+        """Write the tree below 'root' and return how many folders, files and bytes were created"""
+        rng = random.Random(self.seed)
+        text_pool = self._text_pool(rng)
+        stats = {"folders": 0, "files": 0, "bytes": 0}
+        self._generate_folder(rng, text_pool, root, self.depth, stats)
+        return stats
+
+    # Names that GLOBAL_BLACKLISTED_FOLDERS skips, used for the blacklisted subtrees
+    _BLACKLISTED_FOLDER_NAMES = ('node_modules', 'build', 'dist', '__pycache__', '.venv')
+    _TEXT_EXTENSIONS = ('.py', '.txt', '.json', '.md', '.js', '.yaml')
+
+    def _generate_folder(self, rng: random.Random, text_pool: bytes, folder_path: str, depth: int, stats: Dict[str, int]) -> None:
+        os.makedirs(folder_path, exist_ok=True)
+        stats["folders"] += 1
+        for index in range(self.files_per_folder):
+            size = min(self.max_file_bytes, int(rng.lognormvariate(0, self.file_size_sigma) * self.median_file_bytes))
+            if rng.random() < self.binary_ratio:
+                # Half of the binaries have a known extension, the other half can only be found by sniffing
+                name = f"blob_{index}" + rng.choice(('.bin', ''))
+                content = rng.randbytes(size)
+            else:
+                name = f"file_{index}" + rng.choice(self._TEXT_EXTENSIONS)
+                offset = rng.randrange(len(text_pool) - size) if size < len(text_pool) else 0
+                content = (text_pool * (size // len(text_pool) + 1))[offset:offset + size]
+            with open(os.path.join(folder_path, name), 'wb') as f:
+                f.write(content)
+            stats["files"] += 1
+            stats["bytes"] += len(content)
+
+        if depth == 0:
+            return
+        used_names = set()
+        for index in range(self.fan_out):
+            name = f"folder_{index}"
+            if rng.random() < self.blacklisted_subtree_ratio:
+                blacklisted_name = rng.choice(self._BLACKLISTED_FOLDER_NAMES)
+                if blacklisted_name not in used_names:
+                    name = blacklisted_name
+            used_names.add(name)
+            self._generate_folder(rng, text_pool, os.path.join(folder_path, name), depth - 1, stats)
+
+    @staticmethod
+    def _text_pool(rng: random.Random) -> bytes:
+        """One MB of code-like text, mostly ASCII with a few multi-byte characters"""
+        words = ['def', 'return', 'self', 'value', 'import', 'for', 'in', 'range', '(', ')', ':', '=', 'café', '数据', '#']
+        lines = []
+        size = 0
+        while size < 1024 * 1024:
+            line = "    " * rng.randrange(4) + " ".join(rng.choice(words) for _ in range(rng.randrange(2, 12))) + "\n"
+            lines.append(line)
+            size += len(line.encode('utf-8'))
+        return "".join(lines).encode('utf-8')
+
+
+class FolderSerializerBenchmark:
+    """Benchmarks for the hot paths of FolderSerializer. Run this file directly to execute them."""
+
+    @staticmethod
+    def main_benchmark() -> None:
+        parser = argparse.ArgumentParser(description="Benchmark FolderSerializer on a generated folder tree")
+        subparsers = parser.add_subparsers(dest="command")
+
+        suite_parser = subparsers.add_parser("suite", help="Time each phase on a synthetic tree (default)")
+        for spec_field, default in asdict(SyntheticTreeSpec()).items():
+            suite_parser.add_argument(f"--{spec_field.replace('_', '-')}", type=type(default), default=default)
+        suite_parser.add_argument("--workers", type=int, default=1)
+        suite_parser.add_argument("--repeats", type=int, default=3, help="Each phase reports its best of this many runs")
+        suite_parser.add_argument("--save", help="Write results as JSON, e.g. benchmark_results/baseline.json")
+        suite_parser.add_argument("--compare", help="Compare against results saved earlier with --save")
+        suite_parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown that counts as a regression")
+
+        filters_parser = subparsers.add_parser("filters", help="Measure the per-entry cost of the compiled filters")
+        filters_parser.add_argument("--entries", type=int, default=200_000)
+
+        latency_parser = subparsers.add_parser("latency", help="Compare sequential, threaded and async runs on a simulated network mount")
+        latency_parser.add_argument("--latency-ms", type=float, default=10.0, help="Delay of each listing and open")
+        latency_parser.add_argument("--stat-latency-ms", type=float, default=2.0)
+        latency_parser.add_argument("--workers", type=int, default=8, help="Threads of the threaded run")
+        latency_parser.add_argument("--concurrency", type=int, default=FolderSerializer._DEFAULT_ASYNC_CONCURRENCY)
+
+        args = parser.parse_args()
+        if args.command == "filters":
+            FolderSerializerBenchmark.filter_benchmark(args.entries)
+            return
+        if args.command == "latency":
+            FolderSerializerBenchmark.latency_benchmark(SyntheticTreeSpec(depth=2, fan_out=4, files_per_folder=20), args.latency_ms / 1000,
+                                                        args.stat_latency_ms / 1000, args.workers, args.concurrency)
+            return
+        if args.command is None:
+            args = suite_parser.parse_args([])
+
+        spec = SyntheticTreeSpec(**{spec_field: getattr(args, spec_field) for spec_field in asdict(SyntheticTreeSpec())})
+        results = FolderSerializerBenchmark.suite_benchmark(spec, workers=args.workers, repeats=args.repeats)
+        FolderSerializerBenchmark._print_results(results)
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            if FolderSerializerBenchmark.compare_results(baseline, results, args.tolerance):
+                sys.exit(1)
+        if args.save:
+            os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+            with open(args.save, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results saved to {args.save}")
+
+    @staticmethod
+    def suite_benchmark(spec: SyntheticTreeSpec, workers: int = 1, repeats: int = 3) -> Dict:
+        """Generate a tree from 'spec' and time scan, hierarchy, filters, serialize_folder, write_output and stream_output"""
+        temp_folder = tempfile.mkdtemp(prefix="folder_serializer_benchmark_")
+        try:
+            tree_folder = os.path.join(temp_folder, "tree")
+            output_path = os.path.join(temp_folder, "output", "bench_output.txt")
+            tree_stats = spec.generate(tree_folder)
+
+            probe = FolderSerializerBenchmark._create_serializer(tree_folder, workers)
+            scanned_folder = probe._scan_folder()
+            entries = FolderSerializerBenchmark._all_entries(scanned_folder)
+            scanned_files = sum(1 for entry in entries if not entry.is_dir)
+            included_bytes = sum(entry.size for entry in entries if not entry.is_dir and FolderSerializer._needs_read(entry))
+
+            phases = {}
+
+            def run_phase(name: str, action: Callable[[FolderSerializer], None], files: int, bytes_processed: int) -> None:
+                best = None
+                for _ in range(repeats):
+                    serializer = FolderSerializerBenchmark._create_serializer(tree_folder, workers)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        start_time = time.perf_counter()
+                        action(serializer)
+                        elapsed = time.perf_counter() - start_time
+                    best = elapsed if best is None else min(best, elapsed)
+                phases[name] = {
+                    "seconds": best,
+                    "files_per_second": files / best if best else 0.0,
+                    "mb_per_second": bytes_processed / best / 1e6 if best else 0.0,
+                }
+
+            def filter_all(serializer: FolderSerializer) -> None:
+                filters = serializer._get_filters()
+                for entry in entries:
+                    if entry.is_dir:
+                        filters.should_process_folder(entry.name, entry.relative_path)
+                    else:
+                        filters.file_decision(entry.name, entry.relative_path)
+
+            def write_serialized(serializer: FolderSerializer) -> None:
+                serializer._folder_content_as_str = serialized_output
+                serializer.write_output(output_path)
+
+            run_phase("scan", lambda serializer: serializer._scan_folder(), scanned_files, 0)
+            run_phase("hierarchy", lambda serializer: serializer._get_hierarchy(scanned_folder), scanned_files, 0)
+            run_phase("filters", filter_all, len(entries), 0)
+            run_phase("serialize_folder", lambda serializer: serializer.serialize_folder(), scanned_files, included_bytes)
+            with contextlib.redirect_stdout(io.StringIO()):
+                probe.serialize_folder()
+            serialized_output = probe._folder_content_as_str
+            run_phase("write_output", write_serialized, scanned_files, len(serialized_output.encode('utf-8')))
+            run_phase("stream_output", lambda serializer: serializer.stream_output(output_path), scanned_files, included_bytes)
+
+            return {
+                "spec": asdict(spec),
+                "workers": workers,
+                "repeats": repeats,
+                "tree": tree_stats,
+                "commit": FolderSerializerBenchmark._git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "phases": phases,
+                # The process-wide high-water mark only grows, so it is reported for the whole run, not per phase
+                "peak_rss_mb": FolderSerializerBenchmark._peak_rss_mb(),
+            }
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    @staticmethod
+    def compare_results(baseline: Dict, results: Dict, tolerance: float = 0.2) -> bool:
+        """Print per-phase speed relative to 'baseline'. Returns True if any phase regressed beyond 'tolerance'."""
+        if baseline.get("spec") != results.get("spec") or baseline.get("workers") != results.get("workers"):
+            print("Warning: baseline was recorded with a different tree spec or worker count")
+        print(f"\nCompared to baseline from commit {baseline.get('commit')}:")
+        has_regression = False
+        for name, phase in results["phases"].items():
+            baseline_phase = baseline.get("phases", {}).get(name)
+            if baseline_phase is None or not baseline_phase["seconds"]:
+                print(f"  {name:<17} (no baseline)")
+                continue
+            ratio = phase["seconds"] / baseline_phase["seconds"]
+            is_regression = ratio > 1 + tolerance
+            has_regression = has_regression or is_regression
+            print(f"  {name:<17} {ratio:6.2f}x time{'  REGRESSION' if is_regression else ''}")
+        return has_regression
+
+    @staticmethod
+    def filter_benchmark(entries: int = 200_000, seed: int = 0) -> None:
+        """Measure the per-entry cost of the compiled file and folder filters"""
+        rng = random.Random(seed)
+        serializer = FolderSerializerBenchmark._create_serializer(".")
+
+        start_time = time.perf_counter()
+        filters = serializer._get_filters()
+        compile_time = time.perf_counter() - start_time
+
+        # Unique names defeat the memo; repeated names show the memoized cost seen on real trees
+        unique_files = FolderSerializerBenchmark._random_files(rng, entries, unique=True)
+        repeated_files = FolderSerializerBenchmark._random_files(rng, entries, unique=False)
+        folders = FolderSerializerBenchmark._random_folders(rng, entries)
+
+        print(f"Filter compile: {compile_time * 1000:.2f} ms")
+        FolderSerializerBenchmark._report("files, unique names", unique_files, lambda name, path: filters.file_decision(name, path))
+        FolderSerializerBenchmark._report("files, repeated names", repeated_files, lambda name, path: filters.file_decision(name, path))
+        FolderSerializerBenchmark._report("folders, with paths", folders, lambda name, path: filters.should_process_folder(name, path))
+
+    @staticmethod
+    def latency_benchmark(spec: SyntheticTreeSpec, latency: float, stat_latency: float, workers: int = 8,
+                          concurrency: int = FolderSerializer._DEFAULT_ASYNC_CONCURRENCY) -> None:
+        """Time stream_output on a tree behind LatencyFileSystem: sequential, with read threads, and with the async pipeline"""
+        from folder_serializer_async import LatencyFileSystem
+        temp_folder = tempfile.mkdtemp(prefix="folder_serializer_benchmark_")
+        try:
+            tree_folder = os.path.join(temp_folder, "tree")
+            output_path = os.path.join(temp_folder, "output", "bench_output.txt")
+            tree_stats = spec.generate(tree_folder)
+            print(f"Tree: {tree_stats['folders']} folders, {tree_stats['files']} files, "
+                  f"{latency * 1000:.0f} ms per listing/open, {stat_latency * 1000:.0f} ms per stat")
+
+            outputs = {}
+            for name, run_workers, async_io in [("sequential", 1, False), (f"threads={workers}", workers, False), (f"async={concurrency}", 1, True)]:
+                serializer = FolderSerializerBenchmark._create_serializer(tree_folder, run_workers)
+                serializer._file_system = LatencyFileSystem(list_latency=latency, stat_latency=stat_latency, open_latency=latency)
+                serializer._async_io = {"enabled": async_io, "concurrency": concurrency}
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start_time = time.perf_counter()
+                    serializer.stream_output(output_path)
+                    elapsed = time.perf_counter() - start_time
+                with open(output_path, 'rb') as f:
+                    outputs[name] = f.read()
+                print(f"  {name:<17} {elapsed * 1000:9.1f} ms")
+            if len(set(outputs.values())) != 1:
+                print("Outputs differ between runs!")
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+    ###########################
+    ### PRIVATE CLASS STUFF ###
+    ###########################
+
+    _EXTENSIONS = ['.py', '.txt', '.json', '.md', '.js', '.png', '.jpg', '.lock', '', '.min.js', '.yaml', '.cfg']
+    _FOLDER_NAMES = ['src', 'lib', 'tests', 'docs', 'node_modules', '_build', 'Pods', 'build', 'app', 'utils', 'vendor']
+
+    @staticmethod
+    def _create_serializer(folder_to_serialize: str, workers: int = 1) -> FolderSerializer:
+        return FolderSerializer(
+            folder_to_serialize=folder_to_serialize,
+            _blacklist={FolderSerializer._CONFIG_EXTENSIONS: {'.lock'}, FolderSerializer._CONFIG_FILES: {'*.min.js', 'secrets'}, FolderSerializer._CONFIG_FOLDERS: {'fixtures'}},
+            _whitelist={FolderSerializer._CONFIG_EXTENSIONS: set(), FolderSerializer._CONFIG_FILES: set(), FolderSerializer._CONFIG_FOLDERS: set()},
+            _show_first={},
+            _show_last={},
+            _llm_separator={},
+            _workers=workers,
+            _binary_sniffing={"enabled": True},
+        )
+
+    @staticmethod
+    def _all_entries(folder: FolderEntry) -> List[FolderEntry]:
+        entries = []
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            entries.extend(current.files)
+            entries.extend(current.folders)
+            stack.extend(current.folders)
+        return entries
+
+    @staticmethod
+    def _peak_rss_mb() -> float:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+    @staticmethod
+    def _git_commit() -> Optional[str]:
+        try:
+            result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return result.stdout.strip()
+
+    @staticmethod
+    def _print_results(results: Dict) -> None:
+        tree = results["tree"]
+        print(f"Tree: {tree['folders']} folders, {tree['files']} files, {tree['bytes'] / 1e6:.1f} MB (workers={results['workers']})")
+        for name, phase in results["phases"].items():
+            print(f"  {name:<17} {phase['seconds'] * 1000:9.1f} ms  {phase['files_per_second']:11.0f} files/s  "
+                  f"{phase['mb_per_second']:8.1f} MB/s")
+        print(f"Peak RSS over all phases: {results['peak_rss_mb']:.0f} MB")
+
+    @staticmethod
+    def _random_files(rng: random.Random, count: int, unique: bool) -> List[Tuple[str, str]]:
+        files = []
+        for index in range(count):
+            stem = f"file_{index}" if unique else f"file_{rng.randrange(200)}"
+            name = stem + rng.choice(FolderSerializerBenchmark._EXTENSIONS)
+            files.append((name, os.path.join(rng.choice(FolderSerializerBenchmark._FOLDER_NAMES), name)))
+        return files
+
+    @staticmethod
+    def _random_folders(rng: random.Random, count: int) -> List[Tuple[str, str]]:
+        folders = []
+        for _ in range(count):
+            parts = [rng.choice(FolderSerializerBenchmark._FOLDER_NAMES) for _ in range(rng.randint(1, 4))]
+            folders.append((parts[-1], os.path.join(*parts)))
+        return folders
+
+    @staticmethod
+    def _report(label: str, entries: List[Tuple[str, str]], decide) -> None:
+        start_time = time.perf_counter()
+        for name, relative_path in entries:
+            decide(name, relative_path)
+        elapsed = time.perf_counter() - start_time
+        print(f"{label}: {elapsed / len(entries) * 1e9:.0f} ns/entry ({len(entries)} entries in {elapsed * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    FolderSerializerBenchmark.main_benchmark()
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from typing import ClassVar, Dict, Optional
+from dataclasses import dataclass, field
+
+from folder_serializer import FolderEntry
+
+
+@dataclass
+class ContentCache:
+    """On-disk cache of decoded file contents, keyed on relative path plus size, mtime_ns and an optional hash"""
+    cache_folder: str
+    fingerprint: str
+    max_bytes: int = 256 * 1024 * 1024
+    verify_hash: bool = False
+
+    hits: int = 0
+
+    _INDEX_FILE: ClassVar[str] = "index.json"
+    _entries: Dict[str, Dict] = field(default_factory=dict)
+    _is_dirty: bool = False
+    # Lookups and stores may come from several read workers at once
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def load(self) -> None:
+        """Load the index, dropping everything if it was built with a different filter config"""
+        try:
+            with open(os.path.join(self.cache_folder, self._INDEX_FILE), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        if index.get("fingerprint") == self.fingerprint:
+            self._entries = index.get("entries", {})
+        else:
+            # Stale blocks would otherwise be orphaned, since the new index no longer references them
+            shutil.rmtree(os.path.join(self.cache_folder, "blocks"), ignore_errors=True)
+            self._entries = {}
+            self._is_dirty = True
+
+    def lookup(self, entry: FolderEntry, file_path: str) -> Optional[str]:
+        """Return cached content if the file is unchanged, without opening the file itself when size and mtime match"""
+        cached = self._entries.get(entry.relative_path)
+        if cached is None or cached["size"] != entry.size:
+            return None
+        if cached["mtime_ns"] != entry.mtime_ns:
+            # Touched but possibly unchanged: only a matching content hash can rescue the entry
+            if not self.verify_hash or cached.get("hash") is None:
+                return None
+            try:
+                with open(file_path, 'rb') as f:
+                    if hashlib.sha256(f.read()).hexdigest() != cached["hash"]:
+                        return None
+            except OSError:
+                return None
+            cached["mtime_ns"] = entry.mtime_ns
+        content = self._read_block(entry.relative_path)
+        if content is None:
+            return None
+        with self._lock:
+            cached["last_used"] = time.time()
+            self.hits += 1
+            self._is_dirty = True
+        return content
+
+    def store(self, entry: FolderEntry, content: str, raw_content: Optional[bytes] = None) -> None:
+        if not self._write_block(entry.relative_path, content):
+            return
+        cached = {
+            "size": entry.size,
+            "mtime_ns": entry.mtime_ns,
+            "hash": hashlib.sha256(raw_content).hexdigest() if raw_content is not None else None,
+            "length": len(content),
+            "last_used": time.time(),
+        }
+        with self._lock:
+            self._entries[entry.relative_path] = cached
+            self._is_dirty = True
+
+    def save(self) -> None:
+        """Evict least recently used entries until the cache fits in 'max_bytes', then write the index"""
+        if not self._is_dirty:
+            return
+        total_bytes = sum(cached["length"] for cached in self._entries.values())
+        for relative_path in sorted(self._entries, key=lambda path: self._entries[path]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self._entries.pop(relative_path)["length"]
+            self._remove_block(relative_path)
+        self._write_index()
+        self._is_dirty = False
+
+    def _read_block(self, relative_path: str) -> Optional[str]:
+        try:
+            with open(self._block_path(relative_path), 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_block(self, relative_path: str, content: str) -> bool:
+        block_path = self._block_path(relative_path)
+        try:
+            os.makedirs(os.path.dirname(block_path), exist_ok=True)
+            with open(block_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+        except OSError:
+            return False
+        return True
+
+    def _remove_block(self, relative_path: str) -> None:
+        try:
+            os.remove(self._block_path(relative_path))
+        except OSError:
+            pass
+
+    def _write_index(self) -> None:
+        os.makedirs(self.cache_folder, exist_ok=True)
+        with open(os.path.join(self.cache_folder, self._INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"fingerprint": self.fingerprint, "entries": self._entries}, f)
+
+    def _block_path(self, relative_path: str) -> str:
+        name = hashlib.sha1(relative_path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_folder, "blocks", name[:2], name + ".txt")
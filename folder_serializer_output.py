@@ -0,0 +1,159 @@
+import os
+import json
+from typing import BinaryIO, ClassVar, Dict, List, Optional, TextIO
+from dataclasses import dataclass, field
+
+from folder_serializer import FolderEntry
+
+
+@dataclass
+class OutputSink:
+    """Destination of a streamed output: one file or numbered parts, each optionally compressed.
+
+    Parts are only ever cut between pieces, so a file block is never split. With 'stream' set,
+    everything goes to that stream instead (no parts). The manifest doubles as an index: for each
+    file block it records the part, the byte offsets of the block and of its content in the
+    uncompressed part, and the file's size, mtime and content hash (see DumpIndex).
+    """
+    output_path: Optional[str] = None
+    stream: Optional[BinaryIO] = None
+    compression: Optional[str] = None
+    chunk_chars: Optional[int] = None
+    hash_contents: bool = False
+
+    paths: List[str] = field(default_factory=list)
+    manifest_files: List[Dict[str, object]] = field(default_factory=list)
+    manifest_chunks: List[Dict[str, object]] = field(default_factory=list)
+    _file: Optional[BinaryIO] = None
+    _target: Optional[BinaryIO] = None
+    _chunk_chars_written: int = 0
+    _chunk_bytes_written: int = 0
+    # Where notices go; None is stdout, which must not be used when 'stream' is stdout
+    log: Optional[TextIO] = None
+
+    COMPRESSION_SUFFIXES: ClassVar[Dict[str, str]] = {"gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+    _GZIP_LEVEL: ClassVar[int] = 6
+    _XZ_PRESET: ClassVar[int] = 6
+
+    def __post_init__(self) -> None:
+        if self.compression == "zstd" and self._zstd_module() is None:
+            print("zstd needs Python 3.14 or the 'zstandard' package, falling back to gzip", file=self.log)
+            self.compression = "gzip"
+        if self.compression is not None and self.compression not in self.COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression '{self.compression}', expected one of {', '.join(self.COMPRESSION_SUFFIXES)}")
+
+    def open_piece(self, length: int, starts_file: bool) -> BinaryIO:
+        """The stream the next piece goes to. A new part is started when a file block would not fit."""
+        if self._file is None:
+            self._open_chunk()
+        elif (starts_file and self.chunk_chars is not None and self.stream is None
+              and self._chunk_chars_written > 0 and self._chunk_chars_written + length > self.chunk_chars):
+            self._close_chunk()
+            self._open_chunk()
+        return self._file
+
+    def close_piece(self, entry: Optional[FolderEntry], length: int, written_bytes: int,
+                    content_offset: int = 0, content_bytes: int = 0, content_hash: Optional[str] = None) -> None:
+        """Account for a written piece; 'content_offset' is relative to the start of the piece"""
+        if entry is not None:
+            self.manifest_files.append({
+                "path": entry.relative_path,
+                "chunk": len(self.paths) - 1,
+                "offset": self._chunk_bytes_written,
+                "bytes": written_bytes,
+                "chars": length,
+                "content_offset": self._chunk_bytes_written + content_offset,
+                "content_bytes": content_bytes,
+                "size": entry.size,
+                "mtime_ns": entry.mtime_ns,
+                "binary": entry.is_binary,
+                "sha256": content_hash,
+            })
+        self._chunk_chars_written += length
+        self._chunk_bytes_written += written_bytes
+
+    def close(self) -> None:
+        if self._file is None:
+            # Nothing was written, but the output file should still exist
+            self._open_chunk()
+        self._close_chunk()
+        if self.stream is None and self.chunk_chars is not None:
+            # Parts left over from an earlier, longer output would look like part of this one
+            index = len(self.paths)
+            while os.path.exists(self._chunk_path(index)):
+                os.remove(self._chunk_path(index))
+                index += 1
+
+    def write_manifest(self, manifest_path: str, root: str) -> None:
+        manifest = {
+            "root": os.path.abspath(root),
+            "compression": self.compression,
+            "chunks": self.manifest_chunks,
+            "files": self.manifest_files,
+        }
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    def writes_raw_file(self) -> bool:
+        """Whether bytes may go straight to the file descriptor (sendfile), bypassing the stream"""
+        return self.compression is None
+
+    def _open_chunk(self) -> None:
+        if self.stream is not None:
+            self._target = None
+            self.paths.append("-")
+            self._file = self._compressor(self.stream) if self.compression is not None else self.stream
+        else:
+            path = self._chunk_path(len(self.paths))
+            self.paths.append(path)
+            self._target = open(path, 'wb')
+            self._file = self._compressor(self._target) if self.compression is not None else self._target
+        self._chunk_chars_written = 0
+        self._chunk_bytes_written = 0
+
+    def _close_chunk(self) -> None:
+        if self._file is not self._target and self._file is not self.stream:
+            # Finishes the compressed frame; the underlying file or stream is left open
+            self._file.close()
+        if self._target is not None:
+            self._target.close()
+        else:
+            self.stream.flush()
+        # Parts are always next to the manifest, so only their names are recorded
+        self.manifest_chunks.append({"path": os.path.basename(self.paths[-1]), "chars": self._chunk_chars_written, "bytes": self._chunk_bytes_written})
+        self._file = None
+        self._target = None
+
+    def _chunk_path(self, index: int) -> str:
+        path = self.output_path
+        if self.chunk_chars is not None:
+            root, extension = os.path.splitext(path)
+            path = f"{root}.part{index + 1:03d}{extension}"
+        return path + self.COMPRESSION_SUFFIXES.get(self.compression, "")
+
+    def _compressor(self, target: BinaryIO) -> BinaryIO:
+        # Compression modules are only imported when a run needs them, to keep startup short
+        if self.compression == "gzip":
+            import gzip
+            return gzip.GzipFile(fileobj=target, mode='wb', compresslevel=self._GZIP_LEVEL)
+        if self.compression == "xz":
+            import lzma
+            return lzma.LZMAFile(target, mode='wb', preset=self._XZ_PRESET)
+        zstd = self._zstd_module()
+        if hasattr(zstd, "ZstdCompressor") and hasattr(zstd.ZstdCompressor(), "stream_writer"):
+            return zstd.ZstdCompressor().stream_writer(target, closefd=False)
+        return zstd.ZstdFile(target, mode='wb')
+
+    @staticmethod
+    def _zstd_module():
+        """compression.zstd from the standard library (3.14+), else the 'zstandard' package, else None"""
+        try:
+            from compression import zstd
+            return zstd
+        except ImportError:
+            pass
+        try:
+            import zstandard
+            return zstandard
+        except ImportError:
+            return None
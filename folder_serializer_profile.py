@@ -0,0 +1,110 @@
+import json
+import time
+import heapq
+import threading
+from typing import Callable, Dict, List, Tuple
+from dataclasses import dataclass, field
+
+from folder_serializer import FolderEntry
+
+
+@dataclass
+class FileReport:
+    """What happened to one file during a run, as passed to file hooks"""
+    relative_path: str
+    size: int
+    status: str
+    read_seconds: float = 0.0
+    output_chars: int = 0
+
+@dataclass
+class RunProfile:
+    """Wall and CPU time per phase, byte counters and the slowest/largest files of one run.
+
+    CPU time is measured per thread, so with several read workers the phase totals can add up to
+    more than the wall time of the whole run.
+    """
+    top_n: int = 10
+    file_hooks: List[Callable[[FileReport], None]] = field(default_factory=list)
+
+    phases: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    _started: Tuple[float, float] = (0.0, 0.0)
+    _finished: Tuple[float, float] = (0.0, 0.0)
+    # Min-heaps of (value, relative_path), so the smallest of the top N is dropped first
+    _slowest: List[Tuple[float, str]] = field(default_factory=list)
+    _largest: List[Tuple[int, str]] = field(default_factory=list)
+    # Read times measured by the workers, picked up when the file reaches the writer
+    _read_seconds: Dict[str, float] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def begin_run(self) -> None:
+        self.phases = {}
+        self.counters = {}
+        self._slowest = []
+        self._largest = []
+        self._read_seconds = {}
+        self._started = (time.perf_counter(), time.process_time())
+        self._finished = self._started
+
+    def end_run(self) -> None:
+        self._finished = (time.perf_counter(), time.process_time())
+
+    @staticmethod
+    def start() -> Tuple[float, float]:
+        return time.perf_counter(), time.thread_time()
+
+    def stop(self, phase: str, started: Tuple[float, float]) -> float:
+        """Add the time since 'started' to 'phase' and return the wall time in seconds"""
+        wall_seconds = time.perf_counter() - started[0]
+        cpu_seconds = time.thread_time() - started[1]
+        with self._lock:
+            totals = self.phases.setdefault(phase, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+            totals["wall_seconds"] += wall_seconds
+            totals["cpu_seconds"] += cpu_seconds
+            totals["calls"] += 1
+        return wall_seconds
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_read_time(self, relative_path: str, seconds: float) -> None:
+        with self._lock:
+            self._read_seconds[relative_path] = seconds
+
+    def record_file(self, entry: FolderEntry, status: str, output_chars: int = 0) -> None:
+        """Called in output order for every scanned file, whatever happened to it"""
+        with self._lock:
+            read_seconds = self._read_seconds.pop(entry.relative_path, 0.0)
+        self.count(f"files_{status}")
+        if read_seconds:
+            self._push_top(self._slowest, (read_seconds, entry.relative_path))
+            self.count("bytes_read", entry.size)
+        if entry.is_included:
+            self._push_top(self._largest, (entry.size, entry.relative_path))
+        if self.file_hooks:
+            report = FileReport(entry.relative_path, entry.size, status, read_seconds, output_chars)
+            for hook in self.file_hooks:
+                hook(report)
+
+    def report(self) -> Dict[str, object]:
+        """Everything measured so far as a JSON-serializable dict"""
+        return {
+            "wall_seconds": self._finished[0] - self._started[0],
+            "cpu_seconds": self._finished[1] - self._started[1],
+            "phases": self.phases,
+            "counters": self.counters,
+            "slowest_files": [{"path": path, "read_seconds": seconds} for seconds, path in sorted(self._slowest, reverse=True)],
+            "largest_files": [{"path": path, "size": size} for size, path in sorted(self._largest, reverse=True)],
+        }
+
+    def write_report(self, report_path: str) -> None:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def _push_top(self, heap: List[Tuple], item: Tuple) -> None:
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
@@ -0,0 +1,204 @@
+import re
+from abc import ABC, abstractmethod
+from typing import ClassVar, Dict, Iterator, List, Optional, Pattern, Tuple
+from dataclasses import dataclass, field
+
+
+@dataclass
+class LineTransform(ABC):
+    """One step of the content transform stage: turns a stream of lines, each with its '\n', into another.
+
+    Instances hold only configuration; any per-file state lives in apply(), so one instance serves every
+    file of its extension, from any read worker. New transforms are added with @LineTransform.register.
+    """
+    extension: str = ""
+
+    name: ClassVar[str] = ""
+    REGISTRY: ClassVar[Dict[str, type]] = {}
+
+    @classmethod
+    def register(cls, name: str):
+        def decorator(transform_class: type) -> type:
+            transform_class.name = name
+            cls.REGISTRY[name] = transform_class
+            return transform_class
+        return decorator
+
+    @classmethod
+    def create(cls, spec: Dict[str, object], extension: str) -> 'LineTransform':
+        """Build a transform from a config entry such as {"name": "truncate_long_lines", "max_chars": 300}"""
+        transform_class = cls.REGISTRY.get(spec["name"])
+        if transform_class is None:
+            raise ValueError(f"Unknown transform '{spec['name']}', expected one of {', '.join(sorted(cls.REGISTRY))}")
+        options = {key: value for key, value in spec.items() if key != "name"}
+        return transform_class(extension=extension, **options)
+
+    @abstractmethod
+    def apply(self, lines: Iterator[str]) -> Iterator[str]:
+        """Yield the transformed lines. Output must never be longer than input, since budgets are planned on file sizes."""
+
+@LineTransform.register("strip_comments")
+@dataclass
+class StripComments(LineTransform):
+    """Drop lines that are only a comment, and block comments that start a line (license headers included).
+
+    Lines inside multi-line strings (Python triple quotes, JS/Go backticks, ...) are kept. This is a line
+    based heuristic, not a parser: string delimiters are not recognized inside one-line strings, after
+    escapes or in trailing comments, so code such as x = "\"\"\"" can make it misjudge the lines after it.
+    """
+    line: Optional[str] = None
+    block: Optional[List[str]] = None
+    strings: Optional[List[str]] = None
+
+    _LINE_COMMENTS: ClassVar[Dict[str, str]] = {
+        **dict.fromkeys(['.py', '.pyi', '.sh', '.bash', '.zsh', '.rb', '.pl', '.r', '.yaml', '.yml', '.toml', '.cfg', '.ps1', '.tf'], '#'),
+        **dict.fromkeys(['.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.java', '.c', '.h', '.cpp', '.hpp', '.cc', '.cs',
+                         '.go', '.rs', '.swift', '.kt', '.scala', '.dart', '.php', '.gd', '.scss'], '//'),
+        **dict.fromkeys(['.sql', '.lua', '.hs'], '--'),
+        '.ini': ';',
+    }
+    _BLOCK_COMMENTS: ClassVar[Dict[str, Tuple[str, str]]] = {
+        **dict.fromkeys(['.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.java', '.c', '.h', '.cpp', '.hpp', '.cc', '.cs',
+                         '.go', '.rs', '.swift', '.kt', '.scala', '.dart', '.php', '.css', '.scss', '.sql'], ('/*', '*/')),
+        **dict.fromkeys(['.html', '.htm', '.xml', '.svg', '.vue', '.md'], ('<!--', '-->')),
+        '.lua': ('--[[', ']]'),
+        '.hs': ('{-', '-}'),
+    }
+    _MULTILINE_STRINGS: ClassVar[Dict[str, Tuple[str, ...]]] = {
+        **dict.fromkeys(['.py', '.pyi'], ('"""', "'''")),
+        **dict.fromkeys(['.java', '.kt', '.scala', '.swift', '.dart'], ('"""',)),
+        **dict.fromkeys(['.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.go'], ('`',)),
+    }
+
+    def apply(self, lines: Iterator[str]) -> Iterator[str]:
+        line_comment = self.line if self.line is not None else self._LINE_COMMENTS.get(self.extension)
+        block_start, block_end = self.block if self.block is not None else self._BLOCK_COMMENTS.get(self.extension, (None, None))
+        string_delimiters = tuple(self.strings) if self.strings is not None else self._MULTILINE_STRINGS.get(self.extension, ())
+        in_block = False
+        open_string = None
+        for line_number, line in enumerate(lines):
+            if open_string is not None:
+                open_string = self._open_string_after(line, string_delimiters, open_string)
+                yield line
+                continue
+            stripped = line.strip()
+            if in_block:
+                in_block = block_end not in stripped
+                continue
+            if block_start is not None and stripped.startswith(block_start):
+                rest = stripped[len(block_start):]
+                if block_end not in rest:
+                    in_block = True
+                    continue
+                # A one-line block comment is only dropped if no code follows it
+                if rest.endswith(block_end):
+                    continue
+            # Block starts are checked first, since '--[[' also starts with the line comment '--'
+            if line_comment is not None and stripped.startswith(line_comment) and not (line_number == 0 and stripped.startswith("#!")):
+                continue
+            if string_delimiters:
+                open_string = self._open_string_after(line, string_delimiters, None)
+            yield line
+
+    @staticmethod
+    def _open_string_after(line: str, delimiters: Tuple[str, ...], open_string: Optional[str]) -> Optional[str]:
+        """The delimiter of the multi-line string still open at the end of 'line', given the one open before it"""
+        index = 0
+        while True:
+            if open_string is not None:
+                end = line.find(open_string, index)
+                if end == -1:
+                    return open_string
+                index = end + len(open_string)
+                open_string = None
+            else:
+                starts = [(line.find(delimiter, index), delimiter) for delimiter in delimiters]
+                starts = [(start, delimiter) for start, delimiter in starts if start != -1]
+                if not starts:
+                    return None
+                index, open_string = min(starts)
+                index += len(open_string)
+
+@LineTransform.register("collapse_blank_lines")
+@dataclass
+class CollapseBlankLines(LineTransform):
+    """Keep at most 'max_blank' blank lines in a row"""
+    max_blank: int = 1
+
+    def apply(self, lines: Iterator[str]) -> Iterator[str]:
+        blank_run = 0
+        for line in lines:
+            if line.strip():
+                blank_run = 0
+                yield line
+            else:
+                blank_run += 1
+                if blank_run <= self.max_blank:
+                    yield "\n" if line.endswith("\n") else ""
+
+@LineTransform.register("strip_trailing_whitespace")
+@dataclass
+class StripTrailingWhitespace(LineTransform):
+    def apply(self, lines: Iterator[str]) -> Iterator[str]:
+        for line in lines:
+            if line.endswith("\n"):
+                yield line[:-1].rstrip() + "\n"
+            else:
+                yield line.rstrip()
+
+@LineTransform.register("truncate_long_lines")
+@dataclass
+class TruncateLongLines(LineTransform):
+    """Cut lines longer than 'max_chars' (minified code, base64 literals), noting how much was cut"""
+    max_chars: int = 500
+
+    def apply(self, lines: Iterator[str]) -> Iterator[str]:
+        for line in lines:
+            newline = "\n" if line.endswith("\n") else ""
+            omitted_chars = len(line) - len(newline) - self.max_chars
+            if omitted_chars > 0:
+                marker = f" … [{omitted_chars} more characters]"
+                # The marker must never make the line longer
+                if omitted_chars > len(marker):
+                    line = line[:self.max_chars] + marker + newline
+            yield line
+
+@LineTransform.register("elide_lines")
+@dataclass
+class ElideLines(LineTransform):
+    """Drop lines matching the regex 'pattern'.
+
+    With 'marker', each run of dropped lines leaves a note instead, but only if the note is shorter than the
+    run; shorter runs are kept as they are, so the transform never makes a file longer.
+    """
+    pattern: str = ""
+    marker: bool = False
+
+    _regex: Optional[Pattern] = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        if not self.pattern:
+            raise ValueError("elide_lines needs a 'pattern'")
+        self._regex = re.compile(self.pattern)
+
+    def apply(self, lines: Iterator[str]) -> Iterator[str]:
+        elided: List[str] = []
+        for line in lines:
+            if self._regex.search(line):
+                if self.marker:
+                    elided.append(line)
+                continue
+            if elided:
+                yield from self._elided_run(elided)
+                elided = []
+            yield line
+        if elided:
+            yield from self._elided_run(elided)
+
+    def _elided_run(self, elided: List[str]) -> List[str]:
+        marker_line = self._marker_line(len(elided))
+        return [marker_line] if len(marker_line) < sum(len(line) for line in elided) else elided
+
+    @staticmethod
+    def _marker_line(elided: int) -> str:
+        return f"[{elided} line{'s' if elided != 1 else ''} elided]\n"
@@ -0,0 +1,320 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+
+from folder_serializer import FolderSerializer, FolderEntry
+from folder_serializer_cache import ContentCache
+
+
+@dataclass
+class MemoryContentCache(ContentCache):
+    """ContentCache that keeps contents in memory, so unchanged files are never re-read between watch updates"""
+    cache_folder: str = ""
+    fingerprint: str = ""
+    max_bytes: int = sys.maxsize
+    _contents: Dict[str, str] = field(default_factory=dict)
+
+    def retain(self, relative_paths: Set[str]) -> None:
+        """Forget files that no longer exist in the tree"""
+        for relative_path in list(self._entries):
+            if relative_path not in relative_paths:
+                del self._entries[relative_path]
+                self._contents.pop(relative_path, None)
+
+    def _read_block(self, relative_path: str) -> Optional[str]:
+        return self._contents.get(relative_path)
+
+    def _write_block(self, relative_path: str, content: str) -> bool:
+        self._contents[relative_path] = content
+        return True
+
+    def _remove_block(self, relative_path: str) -> None:
+        self._contents.pop(relative_path, None)
+
+    def _write_index(self) -> None:
+        pass
+
+
+class _Inotify:
+    """Minimal ctypes binding to Linux inotify. Raises OSError where inotify is unavailable."""
+
+    _IN_MODIFY = 0x00000002
+    _IN_ATTRIB = 0x00000004
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_DELETE_SELF = 0x00000400
+    _IN_MOVE_SELF = 0x00000800
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_IGNORED = 0x00008000
+    _IN_ONLYDIR = 0x01000000
+    _WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+                   | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    # Returned by read_events() when the kernel queue overflowed and everything must be rescanned
+    OVERFLOW = None
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._folder_by_wd: Dict[int, str] = {}
+        self._wd_by_folder: Dict[str, int] = {}
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def watch_folder(self, folder_path: str, relative_path: str) -> None:
+        if relative_path in self._wd_by_folder:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder_path), self._WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), folder_path)
+        self._folder_by_wd[wd] = relative_path
+        self._wd_by_folder[relative_path] = wd
+
+    def read_events(self, timeout: Optional[float]) -> Optional[List[Tuple[str, str]]]:
+        """Wait up to 'timeout' seconds and return (folder, name) pairs relative to the watched root"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if mask & self._IN_Q_OVERFLOW:
+                return self.OVERFLOW
+            folder = self._folder_by_wd.get(wd)
+            if folder is None:
+                continue
+            if mask & self._IN_IGNORED:
+                # The kernel dropped the watch because the folder is gone
+                del self._folder_by_wd[wd]
+                self._wd_by_folder.pop(folder, None)
+                continue
+            events.append((folder, os.fsdecode(name)))
+        return events
+
+
+@dataclass
+class FolderWatcher:
+    """Keeps the output file of a serializer up to date while files in its folder change"""
+    serializer: FolderSerializer
+    output_path: str
+    debounce_seconds: float = 0.05
+    poll_interval: float = 0.5
+    use_polling: bool = False
+
+    # Per piece of the last written output: its key and its length in bytes
+    _written_keys: List[object] = field(default_factory=list)
+    _written_lengths: List[int] = field(default_factory=list)
+    _folders_by_path: Dict[str, FolderEntry] = field(default_factory=dict)
+
+    def run(self) -> None:
+        """Write the output once, then rewrite it after every burst of changes until interrupted"""
+        self._ignore_own_files()
+        # Created before the first scan, so the output folder does not show up as a change later
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        self.serializer._cache = MemoryContentCache()
+        self._update(self.serializer._scan_folder(), changed_files=None, first_event_time=time.perf_counter())
+        self.serializer.print_summary()
+
+        inotify = None
+        if not self.use_polling:
+            try:
+                inotify = _Inotify()
+                self._watch_new_folders(inotify)
+            except OSError as e:
+                print(f"inotify unavailable ({str(e)}), falling back to polling every {self.poll_interval}s")
+                inotify = None
+
+        print(f"Watching {self.serializer.folder_to_serialize} (Ctrl+C to stop)")
+        try:
+            if inotify is not None:
+                self._run_inotify(inotify)
+            else:
+                self._run_polling()
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    ###########################
+    ### PRIVATE CLASS STUFF ###
+    ###########################
+
+    # Keys of pieces that are not file blocks
+    _HIERARCHY_KEY = "hierarchy"
+    _SEPARATOR_KEY = "separator"
+
+    def _ignore_own_files(self) -> None:
+        """Keep the output file and the cache out of the tree, or every write would trigger another update"""
+        root = os.path.abspath(self.serializer.folder_to_serialize)
+        for path in [self.output_path, os.path.join(os.path.dirname(os.path.dirname(self.output_path)), FolderSerializer._CACHE_FOLDER)]:
+            relative_path = os.path.relpath(os.path.abspath(path), root)
+            if not relative_path.startswith(os.pardir):
+                self.serializer._ignored_relative_paths.add(relative_path)
+
+    def _run_inotify(self, inotify: _Inotify) -> None:
+        while True:
+            events = inotify.read_events(timeout=None)
+            first_event_time = time.perf_counter()
+            changed_folders: Optional[Set[str]] = set()
+
+            # Debounce: keep collecting until the folder has been quiet for 'debounce_seconds'
+            while events:
+                for folder, name in events:
+                    if os.path.join(folder, name) not in self.serializer._ignored_relative_paths:
+                        changed_folders.add(folder)
+                events = inotify.read_events(timeout=self.debounce_seconds)
+            if events is _Inotify.OVERFLOW:
+                changed_folders = None
+            elif not changed_folders:
+                continue
+
+            scanned_folder, changed_files = self._rescan(changed_folders)
+            self._update(scanned_folder, changed_files, first_event_time)
+            self._watch_new_folders(inotify)
+
+    def _run_polling(self) -> None:
+        signatures = self._file_signatures(self.serializer._scanned_folder)
+        while True:
+            time.sleep(self.poll_interval)
+            scanned_folder = self.serializer._scan_folder()
+            new_signatures = self._file_signatures(scanned_folder)
+            if new_signatures == signatures:
+                continue
+            first_event_time = time.perf_counter()
+
+            # Debounce: rescan until two consecutive scans agree
+            while True:
+                time.sleep(self.debounce_seconds)
+                settled_folder = self.serializer._scan_folder()
+                settled_signatures = self._file_signatures(settled_folder)
+                if settled_signatures == new_signatures:
+                    break
+                scanned_folder, new_signatures = settled_folder, settled_signatures
+
+            changed_files = {path for path in set(signatures) | set(new_signatures) if signatures.get(path) != new_signatures.get(path)}
+            self._update(scanned_folder, changed_files, first_event_time)
+            signatures = new_signatures
+
+    def _rescan(self, changed_folders: Optional[Set[str]]) -> Tuple[FolderEntry, Set[str]]:
+        """Rescan only the changed folders (None means everything) and return the tree plus changed file paths"""
+        scanned_folder = self.serializer._scanned_folder
+        old_signatures = self._file_signatures(scanned_folder)
+        if changed_folders is None or "" in changed_folders:
+            scanned_folder = self.serializer._scan_folder()
+        else:
+            # A rescan covers the whole subtree, so nested changed folders are already handled by their ancestor
+            for relative_path in sorted(changed_folders):
+                if any(relative_path.startswith(other + os.sep) for other in changed_folders if other != relative_path):
+                    continue
+                while relative_path and relative_path not in self._folders_by_path:
+                    relative_path = os.path.dirname(relative_path)
+                folder = self._folders_by_path.get(relative_path, scanned_folder)
+                rescanned = FolderEntry(name=folder.name, relative_path=folder.relative_path, is_dir=True, is_included=folder.is_included)
+                folder_path = os.path.join(self.serializer.folder_to_serialize, folder.relative_path)
+                self.serializer._scan_children(rescanned, folder_path)
+                folder.folders, folder.files = rescanned.folders, rescanned.files
+        new_signatures = self._file_signatures(scanned_folder)
+        changed_files = {path for path in set(old_signatures) | set(new_signatures) if old_signatures.get(path) != new_signatures.get(path)}
+        return scanned_folder, changed_files
+
+    def _update(self, scanned_folder: FolderEntry, changed_files: Optional[Set[str]], first_event_time: float) -> None:
+        """Regenerate the output from memory and rewrite the output file from the first piece that differs"""
+        start_time = time.perf_counter()
+        self.serializer._reset_summary()
+        self.serializer._scanned_folder = scanned_folder
+        self._index_folders(scanned_folder)
+        self.serializer._cache.retain({entry.relative_path for entry in self.serializer._iter_files_in_walk_order(scanned_folder)})
+
+        mode = 'r+b' if os.path.exists(self.output_path) and self._written_keys else 'wb'
+        new_keys: List[object] = []
+        new_lengths: List[int] = []
+        offset = 0
+        rewritten_bytes = 0
+        is_rewriting = False
+        with open(self.output_path, mode) as f:
+            for index, (entry, piece) in enumerate(self.serializer._iter_keyed_pieces(scanned_folder)):
+                key = self._piece_key(entry, piece)
+                if not is_rewriting and index < len(self._written_keys) and self._written_keys[index] == key:
+                    new_keys.append(key)
+                    new_lengths.append(self._written_lengths[index])
+                    offset += self._written_lengths[index]
+                    continue
+                if not is_rewriting:
+                    f.seek(offset)
+                    is_rewriting = True
+                # Same bytes as a text mode write, so the file matches what main() produces
+                data = piece.replace("\n", os.linesep).encode("utf-8")
+                f.write(data)
+                rewritten_bytes += len(data)
+                new_keys.append(key)
+                new_lengths.append(len(data))
+            f.truncate()
+        self._written_keys, self._written_lengths = new_keys, new_lengths
+
+        end_time = time.perf_counter()
+        changed = "all" if changed_files is None else len(changed_files)
+        print(f"[watch] {changed} changed file(s), rewrote {rewritten_bytes} bytes of {self.output_path} "
+              f"in {(end_time - start_time) * 1000:.1f} ms ({(end_time - first_event_time) * 1000:.1f} ms since first change)")
+
+    def _piece_key(self, entry: Optional[FolderEntry], piece: str) -> object:
+        if entry is not None:
+            # Dedup and budget decisions can change a block while the file itself stays the same
+            return (entry.relative_path, entry.size, entry.mtime_ns, entry.is_binary, entry.duplicate_of, entry.is_over_budget)
+        if piece is self.serializer._hierarchy:
+            return (self._HIERARCHY_KEY, piece)
+        return (self._SEPARATOR_KEY, piece)
+
+    def _index_folders(self, scanned_folder: FolderEntry) -> None:
+        self._folders_by_path = {}
+        stack = [scanned_folder]
+        while stack:
+            folder = stack.pop()
+            self._folders_by_path[folder.relative_path] = folder
+            stack.extend(subfolder for subfolder in folder.folders if subfolder.is_included)
+
+    def _watch_new_folders(self, inotify: _Inotify) -> None:
+        for relative_path in self._folders_by_path:
+            inotify.watch_folder(os.path.join(self.serializer.folder_to_serialize, relative_path), relative_path)
+
+    def _file_signatures(self, scanned_folder: FolderEntry) -> Dict[str, Tuple[int, int, bool]]:
+        """Everything the output depends on per file, taken from scandir metadata only"""
+        signatures = {}
+        stack = [scanned_folder]
+        while stack:
+            folder = stack.pop()
+            signatures[folder.relative_path + os.sep] = (0, 0, folder.is_included)
+            for entry in folder.files:
+                signatures[entry.relative_path] = (entry.size, entry.mtime_ns, entry.is_included)
+            stack.extend(subfolder for subfolder in folder.folders if subfolder.is_included)
+            for subfolder in folder.folders:
+                if not subfolder.is_included:
+                    signatures[subfolder.relative_path + os.sep] = (0, 0, False)
+        return signatures
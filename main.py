@@ -1,11 +1,66 @@
-import os
-from folder_serializer import FolderSerializer, FolderSerializerTesting
+import sys
+import argparse
 
 #%%
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serialize folders into one text file, or to stdout for piping")
+    parser.add_argument("roots", nargs="*", help="Folders to serialize to stdout (or --output) instead of the config's folder")
+    parser.add_argument("--config", default=None, help="Name of the config in 'program_inputs' (defaults to 'self' without roots)")
+    parser.add_argument("-o", "--output", default=None, help="Output path, '-' for stdout (defaults to stdout with roots, else the config's output)")
+    parser.add_argument("--include-ext", nargs="+", default=[], metavar="EXT", help="Only serialize files with these extensions")
+    parser.add_argument("--exclude-ext", nargs="+", default=[], metavar="EXT", help="Never serialize files with these extensions")
+    parser.add_argument("--include", nargs="+", default=[], metavar="PATTERN", help="Only serialize files matching these names or globs")
+    parser.add_argument("--exclude", nargs="+", default=[], metavar="PATTERN", help="Never serialize files matching these names or globs")
+    parser.add_argument("--include-dir", nargs="+", default=[], metavar="PATTERN", help="Only enter folders matching these names or globs")
+    parser.add_argument("--exclude-dir", nargs="+", default=[], metavar="PATTERN", help="Never enter folders matching these names or globs")
+    parser.add_argument("--self-test", action="store_true", help="Serialize the test folder and compare with the expected output first")
+    parser.add_argument("--workers", type=int, default=None, help="Number of threads used to read files (overrides config)")
+    parser.add_argument("--watch", action="store_true", help="Keep the output up to date as files change")
+    parser.add_argument("--poll", action="store_true", help="With --watch, poll for changes instead of using inotify")
+    parser.add_argument("--batch", nargs="+", metavar="CONFIG", help="Serialize several configs (names or globs) sharing scans per root")
+    parser.add_argument("--jobs", type=int, default=None, help="With --batch, number of processes (defaults to the CPU count)")
+    parser.add_argument("--since", metavar="MANIFEST", help="Only write files changed since the run that wrote this manifest")
+    parser.add_argument("--profile", action="store_true", help="Time each phase and write a JSON report next to the output")
+    args = parser.parse_args()
+
+    if args.roots and (args.batch or args.watch or args.since):
+        parser.error("roots cannot be combined with --batch, --watch or --since")
+    if len(args.roots) > 1 and args.output not in (None, "-"):
+        parser.error("several roots can only be written to stdout")
+    if not args.roots and any(inline_filters(args).values()):
+        parser.error("inline filters need at least one root; use a config otherwise")
+    return args
+
+def inline_filters(args: argparse.Namespace) -> dict:
+    """Filters from the command line, in the shape of a config's blacklist / whitelist"""
+    def extensions(values):
+        return [value.lower() if value.startswith(".") or not value else "." + value.lower() for value in values]
+    filters = {
+        "whitelist": {"extensions": extensions(args.include_ext), "files": args.include, "folders": args.include_dir},
+        "blacklist": {"extensions": extensions(args.exclude_ext), "files": args.exclude, "folders": args.exclude_dir},
+    }
+    return {list_type: {key: values for key, values in lists.items() if values} for list_type, lists in filters.items() if any(lists.values())}
+
 if __name__ == "__main__":
-    # Test run
-    FolderSerializerTesting.main_test()
+    args = parse_args()
+
+    # Imported only now, so '--help' and usage errors return without loading the serializer
+    from folder_serializer import FolderSerializer
+
+    if args.self_test:
+        from folder_serializer import FolderSerializerTesting
+        FolderSerializerTesting.main_test()
+        if not (args.roots or args.config or args.batch or args.watch):
+            sys.exit(0)
 
     # Actual Run
-    config_name = "self" # Input name of config file that should be loaded
-    FolderSerializer.main(config_name)
\ No newline at end of file
+    config_name = args.config or "self" # Name of config file that should be loaded
+    if args.roots:
+        FolderSerializer.main_roots(args.roots, config_name=args.config, filters=inline_filters(args), output_path=args.output,
+                                    workers=args.workers, profile=args.profile)
+    elif args.batch:
+        FolderSerializer.main_batch(args.batch, workers=args.workers, jobs=args.jobs, profile=args.profile)
+    elif args.watch:
+        FolderSerializer.watch(config_name, workers=args.workers, use_polling=args.poll)
+    else:
+        FolderSerializer.main(config_name, workers=args.workers, profile=args.profile, since=args.since, output_path=args.output)